@@ -0,0 +1,122 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from astrbot.api import logger
+
+
+class AnalysisJob:
+    """提交到 AnalysisExecutor 的一个分析任务"""
+
+    def __init__(self, executor, future, stop_event, name):
+        self.executor = executor
+        self.future = future
+        self.stop_event = stop_event
+        self.name = name
+        self.cancelled_at = None
+        self.abandoned = False
+        self._waiter = asyncio.wrap_future(future)
+
+    async def result(self, timeout=None):
+        """
+        等待分析结果；超时或被取消时先发出停止信号并等待任务退出
+
+        Raises:
+            asyncio.TimeoutError: 超时
+        """
+        try:
+            return await asyncio.wait_for(asyncio.shield(self._waiter), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            await self.cancel()
+            raise
+
+    async def cancel(self):
+        """
+        取消任务：尚未开始的直接丢弃；已开始的设置 stop_event，分析器在每个批次之间检查它。
+        超过宽限期仍未退出的记为 abandoned，直到它真正结束。
+        """
+        if self.future.done():
+            return
+        self.stop_event.set()
+        self.cancelled_at = time.monotonic()
+        if self.future.cancel():
+            return
+
+        done, _ = await asyncio.wait({self._waiter}, timeout=self.executor.cancel_grace)
+        if not done:
+            self.executor._abandon(self)
+
+
+class AnalysisExecutor:
+    """
+    分析任务专用的有界线程池
+
+    与 asyncio 默认线程池隔离，同时运行的分析任务数有上限。超时的任务通过 stop_event 协作取消，
+    分析器在批次粒度检查停止信号，因此一个超时本子最多再占用一个批次的推理时间。
+    """
+
+    def __init__(self, max_workers=2, cancel_grace=10.0):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="nh-analyze"
+        )
+        self.cancel_grace = cancel_grace
+        self._lock = threading.Lock()
+        self.in_flight = 0  # 已提交且尚未结束（含排队中）的任务数
+        self.abandoned = 0  # 超时后宽限期内仍未退出的任务数
+        self.timed_out = 0  # 累计被取消的运行中任务数
+
+    def submit(self, fn, *args, stop_event=None, name=""):
+        """
+        提交分析任务，需在事件循环中调用
+
+        Args:
+            fn: 在线程中执行的分析函数
+            stop_event: 传给分析函数的 threading.Event，取消时设置
+            name: 用于日志的任务名（通常为本子 ID）
+        """
+        stop_event = stop_event or threading.Event()
+        with self._lock:
+            self.in_flight += 1
+        future = self._executor.submit(fn, *args)
+        job = AnalysisJob(self, future, stop_event, name)
+        future.add_done_callback(lambda _: self._finish(job))
+        return job
+
+    async def run(self, fn, *args, stop_event=None, name="", timeout=None):
+        """提交并等待一个分析任务"""
+        job = self.submit(fn, *args, stop_event=stop_event, name=name)
+        return await job.result(timeout)
+
+    def _abandon(self, job):
+        with self._lock:
+            if job.future.done():
+                return
+            job.abandoned = True
+            self.abandoned += 1
+        logger.warning(
+            f"[分析] {job.name} 取消后 {self.cancel_grace:g} 秒仍未退出，"
+            f"当前 abandoned={self.abandoned}"
+        )
+
+    def _finish(self, job):
+        with self._lock:
+            self.in_flight -= 1
+            if job.cancelled_at is not None and not job.future.cancelled():
+                self.timed_out += 1
+            if job.abandoned:
+                self.abandoned -= 1
+        if job.cancelled_at is not None and not job.future.cancelled():
+            logger.info(
+                f"[分析] {job.name} 已在取消后 {time.monotonic() - job.cancelled_at:.1f} 秒退出"
+            )
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "abandoned": self.abandoned,
+                "timed_out": self.timed_out,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,17 +1,103 @@
 import os
 import glob
+import hashlib
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
 from PIL import Image
 import torch
 from transformers import pipeline
 from astrbot.api import logger
+from .detections import (
+    NSFW_KEYWORDS,
+    YOLO_NSFW_LABELS,
+    POLICY_TRANSFORMERS,
+    POLICY_YOLO_CLASSIFY,
+    POLICY_YOLO_DETECT,
+    is_ambiguous_page,
+    is_nsfw_page,
+    page_number,
+)
+from .dedup import ContentHashCache, PageDeduper
+from .image_loader import PagePrefetcher, to_bgr_array
+from .scheduler import BatchScheduler
+
+# 推理后端
+BACKEND_PYTORCH = 'pytorch'
+BACKEND_ONNX = 'onnx'
+BACKEND_OPENVINO = 'openvino'
+
+# 模型精度：INT8 模型由 tools/quantize_model.py 生成，文件或目录名中带 int8
+PRECISION_FP32 = 'fp32'
+PRECISION_INT8 = 'int8'
 
 class NSFWAnalyzer:
-    def __init__(self, model_dir, threshold=0.15, device=""):
+    NSFW_KEYWORDS = NSFW_KEYWORDS
+    YOLO_NSFW_LABELS = YOLO_NSFW_LABELS
+
+    # 推理时保留的最低置信度。原始结果按此下限保存，之后任意不低于它的阈值都可离线重算
+    RAW_CONF_FLOOR = 0.01
+    # 分类模型保存的 top-k 标签数
+    RAW_TOP_K = 5
+
+    def __init__(
+        self,
+        model_dir,
+        threshold=0.15,
+        device="",
+        batch_size=8,
+        dedup=True,
+        near_dup_distance=4,
+        prefetch_workers=2,
+        prefetch_depth=2,
+        model_backend="",
+        model_precision=PRECISION_FP32,
+        model_server_socket="",
+        batch_wait_ms=0,
+    ):
         self.model_dir = model_dir
         self.threshold = threshold
         self.device = device
+        # 留空时使用 PyTorch；onnx / openvino 加载 tools/export_model.py 导出的模型
+        self.model_backend = model_backend or BACKEND_PYTORCH
+        self.model_precision = model_precision or PRECISION_FP32
+        # 配置后优先使用本机共享的模型服务，连接失败时退回进程内推理
+        self.model_server_socket = model_server_socket
+        self._server = None
+        self.batch_size = batch_size
+        self.dedup = dedup
+        self.near_dup_distance = near_dup_distance
+        # 按内容哈希缓存逐页原始结果，跨本子共享
+        self._content_cache = ContentHashCache()
+        # 解码预取线程池：推理当前批次时提前解码之后 prefetch_depth 个批次
+        self.prefetch_workers = prefetch_workers
+        self.prefetch_depth = prefetch_depth
+        # 在构造时创建：多个流式分析线程会同时取用，懒创建会各建一个线程池（线程按需启动，不提前占用资源）
+        self._prefetch_executor = None
+        if prefetch_workers > 0:
+            self._prefetch_executor = ThreadPoolExecutor(
+                max_workers=prefetch_workers, thread_name_prefix="nh-decode"
+            )
+        # 大于 0 时多个本子的页面交给同一个推理线程拼批，见 scheduler.BatchScheduler
+        self.batch_wait_ms = batch_wait_ms
+        self._scheduler = None
         self.classifier = None
         self.model_type = None # 'transformers' or 'yolo'
+        self.model_path = None
+        self.backend = None  # 实际加载的推理后端
+        self.precision = None  # 实际加载的模型精度
+        self._model_hash = None
+        self.verdict_policy = None  # 见 detections.POLICY_*
+        self.label_names = {}  # {class_id: label}
+        self.decode_hint = {}  # 解码时缩小的目标尺寸，见 image_loader.load_page
+        # 流式分析时多个本子会在各自线程里共用同一个模型，推理需串行
+        self._infer_lock = threading.Lock()
+        # 加载模型的锁：后台预热与请求线程不会重复加载
+        self._load_lock = threading.Lock()
+        self._warmup_thread = None
+        self.warmup_seconds = None
 
     def _load_model(self):
         """
@@ -19,24 +105,136 @@ class NSFWAnalyzer:
         """
         if self.classifier is not None:
             return
+        # 后台预热进行中时只等待它剩余的部分，不重复加载
+        if self.wait_warmup() and self.classifier is not None:
+            return
 
+        with self._load_lock:
+            if self.classifier is not None:
+                return
+            if self.model_server_socket and self._connect_server():
+                return
+            self._load_local_model()
+
+    def _publish_model(self, classifier, model_type, model_path, backend, precision,
+                       verdict_policy, label_names, decode_hint, model_hash=None):
+        """设置模型信息，最后才设置 classifier：其他线程看到 classifier 非空时模型信息必定完整"""
+        self.model_type = model_type
+        self.model_path = model_path
+        self.backend = backend
+        self.precision = precision
+        self.verdict_policy = verdict_policy
+        self.label_names = label_names
+        self.decode_hint = decode_hint
+        self._model_hash = model_hash
+        self.classifier = classifier
+
+    def _connect_server(self):
+        """连接模型服务并同步模型信息，成功返回 True"""
+        try:
+            from .model_server import ModelClient
+
+            client = ModelClient(self.model_server_socket)
+            info = client.info()
+        except Exception as e:
+            logger.warning(f"无法连接模型服务 {self.model_server_socket}，改为进程内推理: {e}")
+            return False
+
+        self._server = client
+        self._publish_model(
+            client,
+            info["model_type"],
+            self.model_server_socket,
+            info["backend"],
+            info["precision"],
+            info["verdict_policy"],
+            info["label_names"],
+            info["decode_hint"],
+            model_hash=info["model_hash"],
+        )
+        logger.info(f"已连接模型服务 {self.model_server_socket} ({self.model_type}/{self.backend})")
+        return True
+
+    def _fallback_to_local(self, error):
+        """模型服务中途不可用时改为进程内推理"""
+        logger.warning(f"模型服务不可用，改为进程内推理: {error}")
+        with self._load_lock:
+            self._server.close()
+            self._server = None
+            # 加载期间保留原引用，由 _publish_model 整体替换；其他线程不会看到“无模型”的中间状态
+            if not self._load_local_model():
+                self.classifier = None
+                self._model_hash = None
+
+    def _load_local_model(self):
         logger.debug("正在加载 NSFW 检测模型...")
+        attempts = [(self.model_backend, self.model_precision)]
+        if self.model_precision != PRECISION_FP32:
+            # 找不到量化模型时退回同一后端的 FP32 模型
+            attempts.append((self.model_backend, PRECISION_FP32))
+        if self.model_backend != BACKEND_PYTORCH:
+            # 找不到导出模型或对应运行时未安装时退回 PyTorch
+            attempts.append((BACKEND_PYTORCH, PRECISION_FP32))
+
+        for backend, precision in attempts:
+            model = self._load_transformers(backend, precision) or self._load_yolo(backend, precision)
+            if model:
+                self._publish_model(backend=backend, precision=precision, **model)
+                return True
+            if (backend, precision) != (BACKEND_PYTORCH, PRECISION_FP32):
+                logger.warning(f"未找到可用的 {backend} {precision} 模型，尝试下一种")
+
+        logger.warning("未能加载任何模型。将无法进行评分。")
+        return False
+
+    @staticmethod
+    def _hf_backend(path):
+        """判断 Transformers 模型目录属于哪种后端（导出目录会同时带有 config.json）"""
+        if os.path.exists(os.path.join(path, "openvino_model.xml")):
+            return BACKEND_OPENVINO
+        if glob.glob(os.path.join(path, "*.onnx")):
+            return BACKEND_ONNX
+        return BACKEND_PYTORCH
+
+    @staticmethod
+    def _precision(path):
+        name = os.path.basename(os.path.normpath(path)).lower()
+        return PRECISION_INT8 if 'int8' in name else PRECISION_FP32
+
+    def _find_hf_model(self, backend, precision=PRECISION_FP32):
+        """在 models 目录下查找指定后端与精度的 Transformers 模型目录"""
         model_dir = self.model_dir
+        candidates = sorted(
+            os.path.join(model_dir, d) for d in os.listdir(model_dir)
+            if os.path.isdir(os.path.join(model_dir, d))
+        )
+        candidates.append(model_dir)
+        for path in candidates:
+            if not os.path.exists(os.path.join(path, "config.json")):
+                continue
+            if self._hf_backend(path) == backend and self._precision(path) == precision:
+                return path
+        return None
 
+    def _find_yolo_model(self, backend, precision=PRECISION_FP32):
+        """在 models 目录下查找指定后端与精度的 YOLO 模型：.pt / .onnx / *_openvino_model 目录"""
+        model_dir = self.model_dir
+        if backend == BACKEND_ONNX:
+            files = glob.glob(os.path.join(model_dir, "*.onnx"))
+        elif backend == BACKEND_OPENVINO:
+            files = [d for d in glob.glob(os.path.join(model_dir, "*_openvino_model")) if os.path.isdir(d)]
+        else:
+            files = glob.glob(os.path.join(model_dir, "*.pt"))
+        files = [f for f in files if self._precision(f) == precision]
+        return sorted(files)[0] if files else None
+
+    def _load_transformers(self, backend, precision=PRECISION_FP32):
+        """加载 Transformers 模型，成功时返回交给 _publish_model 的模型信息，否则返回 None"""
         # 1. 尝试检测 Transformers 模型
         try:
-            subdirs = [d for d in os.listdir(model_dir) if os.path.isdir(os.path.join(model_dir, d))]
-            hf_model_path = None
-            
-            if subdirs:
-                potential_path = os.path.join(model_dir, subdirs[0])
-                if os.path.exists(os.path.join(potential_path, "config.json")):
-                    hf_model_path = potential_path
-            elif os.path.exists(os.path.join(model_dir, "config.json")):
-                hf_model_path = model_dir
-
+            hf_model_path = self._find_hf_model(backend, precision)
             if hf_model_path:
-                logger.debug(f"检测到 Transformers 模型: {hf_model_path}")
+                logger.debug(f"检测到 Transformers 模型: {hf_model_path} ({backend} {precision})")
                 try:
                     device_id = -1
                     if self.device == "cuda" and torch.cuda.is_available():
@@ -45,41 +243,432 @@ class NSFWAnalyzer:
                         device_id = -1
                     else:
                         device_id = 0 if torch.cuda.is_available() else -1
-                    
-                    self.classifier = pipeline("image-classification", model=hf_model_path, device=device_id)
-                    self.model_type = 'transformers'
+
+                    if backend == BACKEND_PYTORCH:
+                        classifier = pipeline("image-classification", model=hf_model_path, device=device_id)
+                    else:
+                        # 导出模型通过 optimum 加载，仍交给同一个 pipeline 做预处理与后处理
+                        from transformers import AutoImageProcessor
+                        if backend == BACKEND_ONNX:
+                            from optimum.onnxruntime import ORTModelForImageClassification
+                            provider = "CUDAExecutionProvider" if device_id == 0 else "CPUExecutionProvider"
+                            # 量化目录中只有一个 .onnx 文件，文件名不固定，显式指定
+                            onnx_file = sorted(glob.glob(os.path.join(hf_model_path, "*.onnx")))[0]
+                            model = ORTModelForImageClassification.from_pretrained(
+                                hf_model_path, file_name=os.path.basename(onnx_file), provider=provider
+                            )
+                        else:
+                            from optimum.intel import OVModelForImageClassification
+                            model = OVModelForImageClassification.from_pretrained(hf_model_path)
+                        classifier = pipeline(
+                            "image-classification",
+                            model=model,
+                            image_processor=AutoImageProcessor.from_pretrained(hf_model_path),
+                        )
+                    size = getattr(getattr(classifier, 'image_processor', None), 'size', None) or {}
                     logger.debug(f"Transformers 模型加载成功 (Device: {device_id})")
-                    return
+                    return {
+                        'classifier': classifier,
+                        'model_type': 'transformers',
+                        'model_path': hf_model_path,
+                        'verdict_policy': POLICY_TRANSFORMERS,
+                        'label_names': dict(classifier.model.config.id2label),
+                        'decode_hint': {
+                            'short_edge': size.get('shortest_edge') or size.get('height') or 224
+                        },
+                    }
+                except ImportError as e:
+                    logger.warning(f"未安装 {backend} 推理所需的依赖: {e}")
                 except Exception as e:
                     logger.error(f"Transformers 模型加载失败: {e}")
         except Exception as e:
             logger.debug(f"Transformers 检测出错: {e}")
+        return None
 
+    def _load_yolo(self, backend, precision=PRECISION_FP32):
+        """加载 YOLO 模型，成功时返回交给 _publish_model 的模型信息，否则返回 None"""
         # 2. 如果不是 Transformers，尝试 YOLO
         try:
             from ultralytics import YOLO
-            pt_files = glob.glob(os.path.join(model_dir, "*.pt"))
-            if pt_files:
-                model_path = pt_files[0]
-                logger.debug(f"检测到 YOLO 模型: {model_path}")
-                self.classifier = YOLO(model_path)
-                self.model_type = 'yolo'
+            model_path = self._find_yolo_model(backend, precision)
+            if model_path:
+                logger.debug(f"检测到 YOLO 模型: {model_path} ({backend} {precision})")
+                # 导出模型同样由 ultralytics 加载，预处理、NMS 等后处理与 .pt 完全一致
+                classifier = YOLO(model_path)
+                if getattr(classifier, 'task', 'detect') == 'classify':
+                    verdict_policy = POLICY_YOLO_CLASSIFY
+                else:
+                    verdict_policy = POLICY_YOLO_DETECT
+                imgsz = classifier.overrides.get('imgsz') or 640
+                if isinstance(imgsz, (list, tuple)):
+                    imgsz = max(imgsz)
                 logger.debug("YOLO 模型加载成功")
-                return
+                return {
+                    'classifier': classifier,
+                    'model_type': 'yolo',
+                    'model_path': model_path,
+                    'verdict_policy': verdict_policy,
+                    'label_names': dict(classifier.names),
+                    'decode_hint': {'long_edge': int(imgsz)},
+                }
         except ImportError:
             logger.warning("未安装 ultralytics，跳过 YOLO 检测")
         except Exception as e:
             logger.error(f"YOLO 模型加载失败: {e}")
+        return None
 
-        logger.warning("未能加载任何模型。将无法进行评分。")
+    def _hash_model_files(self):
+        """计算已加载模型文件内容的 SHA-1"""
+        if os.path.isfile(self.model_path):
+            model_files = [self.model_path]
+        else:
+            model_files = sorted(
+                f for f in glob.glob(os.path.join(self.model_path, "**", "*"), recursive=True)
+                if os.path.isfile(f)
+            )
+
+        sha1 = hashlib.sha1()
+        for model_file in model_files:
+            sha1.update(os.path.relpath(model_file, self.model_path).encode("utf-8"))
+            with open(model_file, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    sha1.update(chunk)
+        return sha1.hexdigest()
+
+    def model_fingerprint(self):
+        """
+        返回模型类型与模型文件哈希组成的指纹（不含阈值），用作原始检测结果缓存的键
+
+        Returns:
+            str: 指纹；未能加载模型时返回 None
+        """
+        if not self.ensure_model():
+            return None
+        if self._model_hash is None:
+            self._model_hash = self._hash_model_files()
+        return f"{self.model_type}:{self._model_hash}"
+
+    def fingerprint(self):
+        """
+        返回模型文件哈希与阈值组成的指纹，用作评分缓存键的一部分
 
-    def analyze_folder(self, folder_path, stop_event=None):
+        Returns:
+            str: 指纹；未能加载模型时返回 None
+        """
+        model_fingerprint = self.model_fingerprint()
+        if model_fingerprint is None:
+            return None
+        return f"{model_fingerprint}:{self.threshold}"
+
+    def is_nsfw(self, record):
+        """根据单页原始结果和当前阈值判断是否为 NSFW 页"""
+        return is_nsfw_page(self.verdict_policy, self.label_names, record, self.threshold)
+
+    def is_ambiguous(self, record, band):
+        """单页结果是否落在判定边界附近（±band），缩略图评分据此决定是否用原图复核"""
+        return is_ambiguous_page(
+            self.verdict_policy, self.label_names, record, self.threshold, band
+        )
+
+    def _transformers_record(self, outputs):
+        """Transformers pipeline 单张结果 [{'label': 'nsfw', 'score': 0.99}, ...] 转为 [(class_id, conf), ...]"""
+        label2id = {label: cls_id for cls_id, label in self.label_names.items()}
+        return [
+            (label2id[item['label']], float(item['score']))
+            for item in outputs
+            if item['label'] in label2id
+        ]
+
+    def _yolo_record(self, r):
+        """YOLO 单张结果转为 [(class_id, conf), ...]"""
+        # 分类模式：保存 top-k 概率
+        if hasattr(r, 'probs') and r.probs is not None:
+            return [
+                (int(cls_id), float(conf))
+                for cls_id, conf in zip(r.probs.top5, r.probs.top5conf)
+            ]
+
+        # 检测模式：保存所有检测框
+        record = []
+        if hasattr(r, 'boxes'):
+            for box in r.boxes:
+                cls_id = int(box.cls[0])
+                conf = float(box.conf[0])
+                record.append((cls_id, conf))
+        return record
+
+    def _infer_batch(self, images):
+        """对一批已解码的 RGB 图片执行一次前向推理，返回与输入顺序一致的逐页原始结果"""
+        if self._server is not None:
+            from .model_server import ModelServerError
+
+            try:
+                return self._server.infer(images)
+            except ModelServerError:
+                raise
+            except OSError as e:
+                self._fallback_to_local(e)
+                if self.classifier is None:
+                    raise RuntimeError("模型服务不可用且本地模型加载失败")
+
+        if self.model_type == 'transformers':
+            # Transformers Pipeline 直接接收 PIL Image
+            outputs = self.classifier(
+                list(images), batch_size=len(images), top_k=self.RAW_TOP_K
+            )
+            # 单张输入时 pipeline 返回的是单个结果列表，统一成批量形式
+            if len(images) == 1 and outputs and isinstance(outputs[0], dict):
+                outputs = [outputs]
+            return [self._transformers_record(r) for r in outputs]
+
+        elif self.model_type == 'yolo':
+            # 以较低的置信度下限推理，阈值在判定阶段再应用。
+            # NMS 按置信度从高到低保留检测框，低于阈值的框不会影响高于阈值的框，判定结果与直接传入阈值一致。
+            # device 参数 YOLO 会自动处理，或者我们可以显式传入 device=self.device (如果非空)
+            kwargs = {'verbose': False, 'conf': min(self.threshold, self.RAW_CONF_FLOOR)}
+            if self.device:
+                kwargs['device'] = self.device
+            # 传入已解码的 BGR 数组，避免 YOLO 按路径重新读盘解码
+            results = self.classifier([to_bgr_array(img) for img in images], **kwargs)
+            return [self._yolo_record(r) for r in results]
+
+        return [[] for _ in images]
+
+    def _classify_batch(self, pages):
+        """
+        批量推理；整批失败时逐张重试，避免一张坏图拖累整批
+
+        Args:
+            pages: [(img_path, image)]，img_path 仅用于日志
+
+        Returns:
+            与输入顺序一致的逐页原始结果，失败的图片为 None
+        """
+        try:
+            with self._infer_lock:
+                return self._infer_batch([image for _, image in pages])
+        except Exception as e:
+            if len(pages) == 1:
+                logger.warning(f"处理图片 {pages[0][0]} 出错: {e}")
+                return [None]
+            logger.debug(f"批量推理失败，改为逐张推理: {e}")
+
+        records = []
+        for page in pages:
+            records.extend(self._classify_batch([page]))
+        return records
+
+    def _classify(self, pages, stop_event=None):
+        """
+        推理一组页面；启用跨本子拼批时交给调度器，与其他本子的页面合并成批
+
+        Raises:
+            CancelledError: 等待调度器期间收到停止信号，排队中的页面已被丢弃
+        """
+        if self.batch_wait_ms <= 0:
+            return self._classify_batch(pages)
+        if self._scheduler is None:
+            with self._infer_lock:
+                if self._scheduler is None:
+                    self._scheduler = BatchScheduler(
+                        self._classify_batch,
+                        batch_size=self.batch_size,
+                        max_wait=self.batch_wait_ms / 1000,
+                    )
+        return self._scheduler.classify(pages, stop_event)
+
+    def classify_images(self, images):
+        """
+        推理一组已解码的图片（供模型服务等外部调用方使用），按输入顺序返回逐页原始结果
+
+        与本进程内的本子共用推理锁与拼批调度器
+        """
+        return self._classify([("remote", image) for image in images])
+
+    def scheduler_stats(self):
+        """跨本子拼批的统计：批次数、页数、平均每批页数；未启用时返回 None"""
+        return self._scheduler.stats() if self._scheduler else None
+
+    def new_deduper(self):
+        """为一个本子创建页面去重器；关闭去重时返回 None"""
+        if not self.dedup:
+            return None
+        return PageDeduper(self._content_cache, max_distance=self.near_dup_distance)
+
+    def _new_prefetcher(self):
+        capacity = max(1, self.prefetch_depth) * max(1, self.batch_size)
+        return PagePrefetcher(self._prefetch_executor, capacity, **self.decode_hint)
+
+    def _count_hentai_pages(self, pages, detections=None, deduper=None, stop_event=None):
+        """
+        推理一批已解码的图片并返回 NSFW 页数
+
+        Args:
+            pages: PagePrefetcher.take() 的结果 [(img_path, (data, image), error)]，解码失败的图片按非 NSFW 计
+            detections: 可选，记录逐页原始结果
+            deduper: 可选，先跳过重复、近似和空白页，复用已有结果
+            stop_event: 可选，等待共享批次期间收到停止信号时抛出 CancelledError
+        """
+        records = {}
+        pending = []
+        followers = []
+        for img_path, loaded, error in pages:
+            # 单次解码已同时完成有效性检查、缩小到模型输入尺寸附近，并为去重提供原始字节和图像
+            if loaded is None:
+                logger.warning(f"跳过无效图片 {os.path.basename(img_path)}: {error}")
+                continue
+            data, image = loaded
+
+            if deduper is None:
+                pending.append((img_path, image, None))
+                continue
+            try:
+                status, value = deduper.lookup(data, image)
+            except Exception as e:
+                logger.debug(f"页面去重检查失败 {os.path.basename(img_path)}: {e}")
+                status, value = "infer", None
+            if status == "hit":
+                records[img_path] = value
+            elif status == "follow":
+                followers.append((img_path, value))
+            else:
+                pending.append((img_path, image, value))
+
+        if pending:
+            batch_records = self._classify(
+                [(img_path, image) for img_path, image, _ in pending], stop_event
+            )
+            for (img_path, _, token), record in zip(pending, batch_records):
+                records[img_path] = record
+                if token is not None:
+                    deduper.remember(token, record)
+
+        # 近似页复用其代表页的结果（代表页可能在本批或之前的批次）
+        for img_path, token in followers:
+            records[img_path] = deduper.record(token)
+
+        hentai_pages = 0
+        for img_path, _, _ in pages:
+            record = records.get(img_path)
+            if detections is not None:
+                detections.add(page_number(img_path), record)
+            if self.is_nsfw(record):
+                logger.debug(f"  - {os.path.basename(img_path)} 判定为 NSFW 页")
+                hentai_pages += 1
+        return hentai_pages
+
+    def start_warmup(self):
+        """在后台线程中加载模型并用一批空白图片跑一次推理，让首次请求不必承担加载与首次推理的开销"""
+        if self._warmup_thread is not None or self.classifier is not None:
+            return
+        self._warmup_thread = threading.Thread(
+            target=self._warmup, name="nh-warmup", daemon=True
+        )
+        self._warmup_thread.start()
+
+    def wait_warmup(self):
+        """等待后台预热结束；在预热线程内调用或未预热时立即返回。返回是否等待过"""
+        thread = self._warmup_thread
+        if thread is None or thread is threading.current_thread():
+            return False
+        thread.join()
+        return True
+
+    def _warmup(self):
+        started = time.perf_counter()
+        try:
+            self._load_model()
+            if self.classifier is None:
+                return
+            load_seconds = time.perf_counter() - started
+
+            # 顺带计算模型指纹，首个请求查评分缓存时无需再读模型文件
+            self.model_fingerprint()
+
+            # 首次推理会触发算子选择、显存/内存池分配等一次性开销，用一整批空白图片提前触发
+            size = self.decode_hint.get('long_edge') or self.decode_hint.get('short_edge') or 224
+            image = Image.new('RGB', (size, size), (128, 128, 128))
+            self._classify_batch([("warmup", image)] * max(1, self.batch_size))
+
+            self.warmup_seconds = time.perf_counter() - started
+            logger.info(
+                f"模型预热完成: warmup_seconds={self.warmup_seconds:.2f} "
+                f"(加载 {load_seconds:.2f}s, {self.model_type}/{self.backend})"
+            )
+        except Exception as e:
+            logger.warning(f"模型预热失败: {e}")
+
+    def close(self):
+        """释放模型服务连接、解码线程池与推理调度线程"""
+        if self._server is not None:
+            self._server.close()
+        if self._prefetch_executor is not None:
+            self._prefetch_executor.shutdown(wait=False, cancel_futures=True)
+            self._prefetch_executor = None
+        if self._scheduler is not None:
+            self._scheduler.close()
+            self._scheduler = None
+
+    def ensure_model(self):
+        """确保模型已加载，返回是否可用"""
+        if self.classifier is None:
+            self._load_model()
+        return self.classifier is not None
+
+    def count_hentai_pages(self, img_paths, stop_event=None, detections=None, deduper=None):
+        """
+        对给定图片分批推理，返回其中 NSFW 页数
+
+        Args:
+            img_paths: 图片路径列表，无效图片按非 NSFW 计
+            stop_event: 可选，每个批次之间检查一次
+            detections: 可选，GalleryDetections，用于记录逐页原始结果
+            deduper: 可选，同一本子跨批次共用的 PageDeduper
+
+        Returns:
+            int: NSFW 页数；被中断时返回 None
+        """
+        if not self.ensure_model():
+            return 0
+
+        return self._run_batches(img_paths, stop_event, detections, deduper)
+
+    def _run_batches(self, img_paths, stop_event=None, detections=None, deduper=None):
+        """分批推理一组图片，返回 NSFW 页数；被中断时返回 None"""
+        batch_size = max(1, self.batch_size)
+        prefetcher = self._new_prefetcher()
+        remaining = iter(img_paths)
+
+        def fill():
+            for img_path in itertools.islice(remaining, prefetcher.free):
+                prefetcher.submit(img_path)
+
+        hentai_pages = 0
+        fill()
+        try:
+            while len(prefetcher):
+                # 检查停止信号
+                if stop_event and stop_event.is_set():
+                    raise CancelledError()
+
+                batch = prefetcher.take(batch_size)
+                # 先提交后续页面的解码任务，再推理当前批次
+                fill()
+                hentai_pages += self._count_hentai_pages(batch, detections, deduper, stop_event)
+        except CancelledError:
+            logger.warning("分析任务中断")
+            prefetcher.cancel()
+            return None
+        return hentai_pages
+
+    def analyze_folder(self, folder_path, stop_event=None, detections=None):
         """
         分析文件夹中的所有图片
         
         Args:
             folder_path: 文件夹路径
-            stop_event: 可选，用于检测是否需要中断分析 (threading.Event)
+            stop_event: 可选，用于检测是否需要中断分析 (threading.Event)，每个批次之间检查一次
+            detections: 可选，GalleryDetections，用于记录逐页原始结果以便之后按其他阈值重算
         """
         if self.classifier is None:
             self._load_model()
@@ -96,101 +685,103 @@ class NSFWAnalyzer:
         if self.classifier is None:
             return 0, {"error": "No model loaded"}
 
-        hentai_pages = 0
-        
-        # 关键词，根据模型不同可能需要调整
-        # EraX 这类模型通常会有 explicit, nsfw, porn 等标签
-        nsfw_keywords = ['nsfw', 'porn', 'hentai', 'sexual', 'explicit', 'sex']
+        batch_size = max(1, self.batch_size)
+        deduper = self.new_deduper()
+
+        logger.debug(f"正在分析 {total_pages} 张图片 (批大小 {batch_size})...")
+        # 无效图片仍计入总页数
+        hentai_pages = self._run_batches(image_files, stop_event, detections, deduper)
+        if hentai_pages is None:
+            return 0, {"error": "Interrupted"}
+
+        score = (hentai_pages / total_pages) * 100
+        stats = {"total": total_pages, "hentai": hentai_pages}
+        if deduper:
+            stats.update(deduper.stats())
         
-        logger.debug(f"正在分析 {total_pages} 张图片...")
-        for img_path in image_files:
-            # 检查停止信号
-            if stop_event and stop_event.is_set():
-                logger.warning("分析任务中断")
-                return 0, {"error": "Interrupted"}
+        return score, stats
 
-            try:
-                is_nsfw = False
-                
-                # 验证图片有效性
+    def analyze_stream(self, page_queue, stop_event=None, detections=None, on_consumed=None):
+        """
+        流式分析：边下载边推理
+
+        Args:
+            page_queue: queue.Queue，下载完成的图片路径会逐个放入，放入 None 表示本子已下载结束；
+                内存模式下放入 (文件名, 原始字节)
+            stop_event: 可选，用于检测是否需要中断分析 (threading.Event)
+            detections: 可选，GalleryDetections，用于记录逐页原始结果
+            on_consumed: 可选回调 on_consumed(文件名)，每页分析完毕后调用，用于归还内存预算
+
+        Returns:
+            与 analyze_folder 相同的 (score, stats)
+        """
+        if self.classifier is None:
+            self._load_model()
+
+        batch_size = max(1, self.batch_size)
+        deduper = self.new_deduper()
+        prefetcher = self._new_prefetcher()
+        total_pages = 0
+        hentai_pages = 0
+        finished = False
+
+        def fill(block):
+            # 把已到达的图片交给解码线程池，直到预取窗口占满；block 时至少等到一张图片或结束标记
+            nonlocal finished
+            while not finished and prefetcher.free:
                 try:
-                    with Image.open(img_path) as img:
-                        img.verify()
-                except Exception as e:
-                    logger.warning(f"跳过无效图片 {os.path.basename(img_path)}: {e}")
+                    item = page_queue.get(timeout=0.5) if block else page_queue.get_nowait()
+                except queue.Empty:
+                    if block:
+                        return False
+                    break
+                if item is None:
+                    finished = True
+                else:
+                    prefetcher.submit(item)
+                block = False
+            return True
+
+        try:
+            while not finished or len(prefetcher):
+                # 检查停止信号
+                if stop_event and stop_event.is_set():
+                    raise CancelledError()
+
+                # 没有待推理的图片时阻塞等待下一张，同时响应停止信号
+                if not fill(block=not len(prefetcher)):
+                    continue
+                if not len(prefetcher):
                     continue
 
-                if self.model_type == 'transformers':
-                    # Transformers Pipeline 推理
-                    # 需要将图片文件转换为 Image 对象
-                    with Image.open(img_path) as img:
-                        results = self.classifier(img)
-                    
-                    # results 是一个列表 [{'label': 'nsfw', 'score': 0.99}, ...]
-                    # 检查 top1
-                    if results:
-                        top = results[0]
-                        label = top['label'].lower()
-                        score = top['score']
-                        # 调试输出
-                        # print(f"{os.path.basename(img_path)}: {label} ({score:.2f})")
-                        
-                        if any(k in label for k in nsfw_keywords) and score > self.threshold:
-                            is_nsfw = True
-                        elif label == 'normal' or label == 'safe':
-                            is_nsfw = False
-                        else:
-                            # 如果 top1 不是 safe 且分数很高，也算
-                            if score > 0.8:
-                                is_nsfw = True
-                                
-                elif self.model_type == 'yolo':
-                    # YOLO 推理使用配置的阈值
-                    # device 参数 YOLO 会自动处理，或者我们可以显式传入 device=self.device (如果非空)
-                    kwargs = {'verbose': False, 'conf': self.threshold}
-                    if self.device:
-                        kwargs['device'] = self.device
-                        
-                    results = self.classifier(img_path, **kwargs)
-                    for r in results:
-                        # 分类模式
-                        if hasattr(r, 'probs') and r.probs is not None:
-                            top1 = r.probs.top1
-                            label = r.names[top1].lower()
-                            if any(k in label for k in nsfw_keywords):
-                                is_nsfw = True
-                        # 检测模式
-                        elif hasattr(r, 'boxes'):
-                            for box in r.boxes:
-                                cls_id = int(box.cls[0])
-                                label = r.names[cls_id].lower()
-                                conf = float(box.conf[0])
-                                logger.debug(f"  - 检测到: {label} (置信度: {conf:.2f})") # 调试输出
-
-                                # EraX-NSFW-V1.0 模型定义的标签:
-                                # anus, make_love, nipple, penis, vagina
-                                
-                                # 只要检测到 make_love (交合) 或 penis/vagina/anus (关键部位) 即视为 NSFW 页
-                                # nipple 单独出现可能只是擦边，但也计入 NSFW
-                                keywords = [
-                                    'make_love',
-                                    'penis',
-                                    'vagina',
-                                    'anus',
-                                    'nipple'
-                                ]
-                                if any(k in label for k in keywords):
-                                    is_nsfw = True
-                                    logger.debug(f"    -> 判定为 NSFW 目标")
-                                    break
-
-                if is_nsfw:
-                    hentai_pages += 1
-                    
-            except Exception as e:
-                logger.warning(f"处理图片 {img_path} 出错: {e}")
+                batch = prefetcher.take(batch_size)
+                # 取走一批后立即补充预取窗口，下一批的解码与当前批次推理并行
+                fill(block=False)
 
+                # 只统计实际推理过的页面；没有可用模型时结束后返回错误，不会得到被低估的分数
+                if self.classifier is not None:
+                    total_pages += len(batch)
+                    hentai_pages += self._count_hentai_pages(
+                        batch, detections, deduper, stop_event
+                    )
+                if on_consumed:
+                    for img_path, _, _ in batch:
+                        on_consumed(img_path)
+        except CancelledError:
+            logger.warning("分析任务中断")
+            prefetcher.cancel()
+            return 0, {"error": "Interrupted"}
+
+        if self.classifier is None:
+            return 0, {"error": "No model loaded"}
+
+        if total_pages == 0:
+            return 0, {}
+
+        logger.debug(f"流式分析完成，共 {total_pages} 张图片")
         score = (hentai_pages / total_pages) * 100
         stats = {"total": total_pages, "hentai": hentai_pages}
-        
-        return score, stats
\ No newline at end of file
+        if deduper:
+            stats.update(deduper.stats())
+
+        return score, stats
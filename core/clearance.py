@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+import time
+from astrbot.api import logger
+
+
+class ClearanceStore:
+    """
+    Cloudflare 会话状态（cookie 与 User-Agent）的持久化
+
+    cf_clearance 与求解质询时的 User-Agent 绑定，两者一起保存到 data 目录下的小 JSON 文件，重启后直接恢复，
+    不必在第一次请求时重新求解质询。有效期取 cookie 自带的过期时间与 ttl 中较早者；
+    临近过期（剩余不足 refresh_margin 秒）时由爬虫提前刷新。
+    """
+
+    # 刷新失败后至少间隔多久（秒）再试
+    REFRESH_RETRY_INTERVAL = 60
+
+    def __init__(self, path, ttl_seconds=30 * 60, refresh_margin=300):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        # 有效期较短时按比例缩小提前量，避免刚保存就需要刷新
+        self.refresh_margin = min(refresh_margin, ttl_seconds / 5)
+        self.expires_at = 0.0
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        return self.expires_at - time.time()
+
+    def needs_refresh(self):
+        """已有会话且临近过期，且不在刷新失败后的等待期内"""
+        return (
+            self.expires_at > 0
+            and self.remaining() < self.refresh_margin
+            and time.time() >= self._retry_at
+        )
+
+    def defer_refresh(self):
+        """刷新失败后暂缓下一次刷新"""
+        self._retry_at = time.time() + self.REFRESH_RETRY_INTERVAL
+
+    def load(self, scraper):
+        """把未过期的会话恢复到 cloudscraper 会话中，返回是否恢复成功"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取 Cloudflare 会话状态失败: {e}")
+            return False
+
+        now = time.time()
+        expires_at = float(state.get("expires_at", 0))
+        if expires_at <= now:
+            logger.debug("保存的 Cloudflare 会话已过期，忽略")
+            return False
+
+        if state.get("user_agent"):
+            scraper.headers["User-Agent"] = state["user_agent"]
+        for cookie in state.get("cookies", []):
+            if cookie.get("expires") and cookie["expires"] <= now:
+                continue
+            scraper.cookies.set(
+                cookie["name"],
+                cookie["value"],
+                domain=cookie.get("domain") or "",
+                path=cookie.get("path") or "/",
+                expires=cookie.get("expires"),
+                secure=bool(cookie.get("secure")),
+            )
+        self.expires_at = expires_at
+        logger.info(f"已恢复 Cloudflare 会话，剩余 {self.remaining() / 60:.0f} 分钟")
+        return True
+
+    def save(self, scraper):
+        """保存 cloudscraper 会话当前的 cookie 与 User-Agent；没有 cookie 时不保存"""
+        now = time.time()
+        cookies = []
+        expires_at = now + self.ttl_seconds
+        for cookie in list(scraper.cookies):
+            if cookie.expires and cookie.expires <= now:
+                continue
+            cookies.append(
+                {
+                    "name": cookie.name,
+                    "value": cookie.value,
+                    "domain": cookie.domain,
+                    "path": cookie.path,
+                    "expires": cookie.expires,
+                    "secure": bool(cookie.secure),
+                }
+            )
+            if cookie.name == "cf_clearance" and cookie.expires:
+                expires_at = min(expires_at, cookie.expires)
+        if not cookies:
+            return False
+
+        state = {
+            "user_agent": scraper.headers.get("User-Agent", ""),
+            "cookies": cookies,
+            "saved_at": now,
+            "expires_at": expires_at,
+        }
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                part_path = self.path + ".part"
+                with open(part_path, "w", encoding="utf-8") as f:
+                    json.dump(state, f, ensure_ascii=False)
+                os.replace(part_path, self.path)
+            except OSError as e:
+                logger.warning(f"保存 Cloudflare 会话状态失败: {e}")
+                return False
+            self.expires_at = expires_at
+        return True
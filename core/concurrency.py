@@ -0,0 +1,137 @@
+import asyncio
+import time
+from collections import deque
+from astrbot.api import logger
+
+OUTCOME_OK = "ok"
+OUTCOME_CONGESTED = "congested"
+
+
+class _Slot:
+    """一次请求占用的并发名额，记录首个结果：成功（附首字节延迟）或拥塞；未记录的视为中性"""
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.outcome = None
+        self.latency = None
+
+    def success(self, latency):
+        if self.outcome is None:
+            self.outcome = OUTCOME_OK
+            self.latency = latency
+
+    def congested(self):
+        if self.outcome is None:
+            self.outcome = OUTCOME_CONGESTED
+
+    async def __aenter__(self):
+        await self.limiter.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.limiter.release(self.outcome, self.latency)
+
+
+class AIMDLimiter:
+    """
+    加性增、乘性减（AIMD）的自适应下载并发控制器，所有本子的下载共享一个
+
+    并发名额用满且请求健康时，每完成一个请求上限增加 1/上限（约每轮增加 1）；
+    遇到 429、5xx、超时或首字节延迟明显高于基线时上限减半，冷却期内只减一次，避免同一波失败连续减半。
+    """
+
+    def __init__(
+        self,
+        initial=8,
+        min_limit=1,
+        max_limit=16,
+        decrease=0.5,
+        latency_factor=3.0,
+        cooldown=1.0,
+    ):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._waiters = deque()
+        self._latency = None  # 首字节延迟的 EWMA
+        self._base_latency = None  # 延迟基线：EWMA 的最小值，缓慢上浮以适应网络变化
+        self._last_decrease = 0.0
+        self.peak = int(self.limit)
+        self.decreases = 0
+
+    @property
+    def current_limit(self):
+        return max(self.min_limit, int(self.limit))
+
+    def slot(self):
+        """获取一个并发名额：async with limiter.slot() as slot: ...; slot.success(latency) / slot.congested()"""
+        return _Slot(self)
+
+    async def acquire(self):
+        while self.in_flight >= self.current_limit:
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                # 已被唤醒却被取消时，把名额让给下一个等待者
+                if future.done() and not future.cancelled():
+                    self._wake()
+                raise
+        self.in_flight += 1
+
+    def release(self, outcome=None, latency=None):
+        saturated = self.in_flight >= self.current_limit
+        self.in_flight -= 1
+        if outcome == OUTCOME_OK:
+            if latency is not None and self._observe_latency(latency):
+                self._decrease("延迟升高")
+            elif saturated:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self.peak = max(self.peak, self.current_limit)
+        elif outcome == OUTCOME_CONGESTED:
+            self._decrease("请求失败")
+        self._wake()
+
+    def _observe_latency(self, latency):
+        """记录一次首字节延迟，返回延迟是否已明显高于基线"""
+        if self._latency is None:
+            self._latency = latency
+        else:
+            self._latency = 0.8 * self._latency + 0.2 * latency
+        if self._base_latency is None:
+            self._base_latency = self._latency
+        else:
+            self._base_latency = min(self._latency, self._base_latency * 1.01)
+        return self._latency > self._base_latency * self.latency_factor
+
+    def _decrease(self, reason):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        previous = self.current_limit
+        self.limit = max(self.min_limit, self.limit * self.decrease)
+        self.decreases += 1
+        logger.debug(f"[下载] {reason}，并发上限 {previous} -> {self.current_limit}")
+
+    def _wake(self):
+        free = self.current_limit - self.in_flight
+        while free > 0 and self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                free -= 1
+
+    def stats(self):
+        return {
+            "limit": self.current_limit,
+            "peak": self.peak,
+            "in_flight": self.in_flight,
+            "decreases": self.decreases,
+            "latency_ms": round(self._latency * 1000) if self._latency is not None else None,
+        }
@@ -4,28 +4,220 @@ from bs4 import BeautifulSoup
 import re
 import json
 import asyncio
-from urllib.parse import urlparse
+import threading
+import time
+import aiohttp
+from urllib.parse import urljoin, urlparse
 from astrbot.api import logger
 
+# Cloudflare 质询页的特征
+CHALLENGE_MARKERS = ("cf-chl", "challenge-platform", "Just a moment...", "cf_chl_opt")
+
+
+class AsyncResponse:
+    """异步抓取的响应，提供与 requests.Response 相同的 status_code / text / headers"""
+
+    def __init__(self, status_code, text, headers):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers
+        self.encoding = "utf-8"
 
-class NHCrawler:
-    def __init__(self, proxy=None):
-        # 使用更具体的浏览器指纹配置
-        self.scraper = cloudscraper.create_scraper(
-            browser={"browser": "chrome", "platform": "windows", "desktop": True}
-        )
-        self.base_url = "https://nhentai.net"
 
+def is_challenge(status_code, headers, text):
+    """判断响应是否为 Cloudflare 质询（需要 cloudscraper 求解）"""
+    if headers.get("cf-mitigated", "").lower() == "challenge":
+        return True
+    if status_code in (403, 429, 503) and "cloudflare" in headers.get("Server", "").lower():
+        return any(marker in text for marker in CHALLENGE_MARKERS)
+    return False
+
+
+class NHCrawler:
+    def __init__(
+        self,
+        proxy=None,
+        rate_limiter=None,
+        http_pool=None,
+        async_fetch=True,
+        clearance_store=None,
+        metadata_source="api",
+    ):
         # 配置代理: 优先使用传入的配置，否则读取环境变量
         if not proxy:
             proxy = os.environ.get("HTTP_PROXY") or os.environ.get("HTTPS_PROXY")
 
+        self.proxy = proxy
+        self.scraper = self._new_scraper()
         if proxy:
-            self.scraper.proxies = {"http": proxy, "https": proxy}
             print(f"Crawler 使用代理: {proxy}")
         else:
             print("Crawler 未配置代理，将尝试直连。")
 
+        self.base_url = "https://nhentai.net"
+        # 可选的按主机限速（HostRateLimiter），与下载器共用
+        self.rate_limiter = rate_limiter
+        # 异步抓取：复用下载器的连接池与 cloudscraper 取得的 clearance cookie，遇到质询时才交给 cloudscraper
+        self.http_pool = http_pool
+        self.async_fetch = async_fetch and http_pool is not None
+        # requests 会话不是线程安全的，cloudscraper 请求串行执行
+        self._scraper_lock = threading.Lock()
+        self.async_requests = 0
+        self.scraper_requests = 0
+        self.challenges = 0
+        # 持久化的 Cloudflare 会话：启动时恢复，临近过期时提前刷新
+        self.clearance = clearance_store
+        self._refresh_lock = asyncio.Lock()
+        self.clearance_refreshes = 0
+        # 本子元数据来源：api 为 /api/gallery/{id}（失败时回退 HTML），html 为详情页
+        self.metadata_source = metadata_source
+        self.metadata_stats = {
+            source: {"requests": 0, "bytes": 0, "parse_seconds": 0.0} for source in ("api", "html")
+        }
+        self.metadata_fallbacks = 0
+        if self.clearance:
+            self.clearance.load(self.scraper)
+
+    def _new_scraper(self):
+        # 使用更具体的浏览器指纹配置
+        scraper = cloudscraper.create_scraper(
+            browser={"browser": "chrome", "platform": "windows", "desktop": True}
+        )
+        if self.proxy:
+            scraper.proxies = {"http": self.proxy, "https": self.proxy}
+        return scraper
+
+    def _cookie_snapshot(self):
+        return {(c.name, c.value) for c in list(self.scraper.cookies)}
+
+    def _scraper_get(self, url, timeout):
+        with self._scraper_lock:
+            before = self._cookie_snapshot()
+            resp = self.scraper.get(url, timeout=timeout)
+            # 求解质询后拿到新的 clearance，立即持久化
+            if self.clearance and self._cookie_snapshot() != before:
+                self.clearance.save(self.scraper)
+            return resp
+
+    def _refresh_clearance_sync(self, timeout):
+        """用新的 cloudscraper 会话重新求解质询，成功后才替换当前会话；失败时旧的 clearance 继续可用"""
+        scraper = self._new_scraper()
+        resp = scraper.get(self.base_url, timeout=timeout)
+        if resp.status_code != 200:
+            raise Exception(f"status {resp.status_code}")
+        with self._scraper_lock:
+            self.scraper = scraper
+            return self.clearance.save(scraper)
+
+    async def _ensure_clearance(self, timeout=30):
+        """保存的 Cloudflare 会话临近过期时，在后续请求之前提前刷新"""
+        if not self.clearance or not self.clearance.needs_refresh():
+            return
+        async with self._refresh_lock:
+            if not self.clearance.needs_refresh():
+                return
+            if self.rate_limiter:
+                await self.rate_limiter.acquire(self.base_url)
+            try:
+                saved = await asyncio.wait_for(
+                    asyncio.to_thread(self._refresh_clearance_sync, timeout),
+                    timeout=timeout + 5,
+                )
+            except Exception as e:
+                saved = False
+                logger.warning(f"刷新 Cloudflare 会话失败，继续使用当前会话: {e}")
+            else:
+                self.clearance_refreshes += 1
+            self.scraper_requests += 1
+            if saved:
+                logger.info(
+                    f"已刷新 Cloudflare 会话，剩余 {self.clearance.remaining() / 60:.0f} 分钟"
+                )
+            else:
+                # 刷新失败或没有拿到可保存的会话时暂缓重试，不让之后的每个请求都先刷新一次
+                self.clearance.defer_refresh()
+
+    def _clearance_headers(self):
+        """异步请求沿用 cloudscraper 的 User-Agent 与 cookie（含 cf_clearance），clearance 与 UA 绑定"""
+        headers = {
+            "User-Agent": self.scraper.headers.get("User-Agent", ""),
+            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+            "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
+        }
+        cookies = "; ".join(f"{c.name}={c.value}" for c in list(self.scraper.cookies))
+        if cookies:
+            headers["Cookie"] = cookies
+        return headers
+
+    async def _fetch_async(self, url, timeout):
+        """用共享连接池抓取页面；遇到 Cloudflare 质询时返回 None"""
+        session = await self.http_pool.session()
+        async with session.get(
+            url,
+            headers=self._clearance_headers(),
+            timeout=aiohttp.ClientTimeout(total=timeout),
+            proxy=self.proxy,
+        ) as response:
+            text = await response.text(encoding="utf-8", errors="replace")
+            if is_challenge(response.status, response.headers, text):
+                return None
+            # Cloudflare 会轮换 __cf_bm 等 cookie，写回 cloudscraper 会话供后续请求使用
+            for name, morsel in response.cookies.items():
+                self.scraper.cookies.set(name, morsel.value, domain=morsel["domain"] or None)
+            return AsyncResponse(response.status, text, response.headers)
+
+    async def _fetch(self, url, timeout):
+        """按主机限速后请求页面；遇到 429/503 时遵守 Retry-After
+
+        启用异步抓取时先走共享连接池，只有遇到 Cloudflare 质询才改用 cloudscraper（在线程中求解质询，
+        之后的异步请求沿用它拿到的 clearance cookie）。
+        """
+        await self._ensure_clearance(timeout)
+        if self.async_fetch:
+            if self.rate_limiter:
+                await self.rate_limiter.acquire(url)
+            resp = await self._fetch_async(url, timeout)
+            if resp is not None:
+                self.async_requests += 1
+                if self.rate_limiter and resp.status_code in (429, 503):
+                    self.rate_limiter.retry_after(url, resp.headers.get("Retry-After"))
+                return resp
+            self.challenges += 1
+            logger.debug(f"检测到 Cloudflare 质询，改用 cloudscraper: {url}")
+
+        if self.rate_limiter:
+            await self.rate_limiter.acquire(url)
+        # 使用 asyncio.wait_for 包装同步请求，实现超时控制
+        resp = await asyncio.wait_for(
+            asyncio.to_thread(self._scraper_get, url, timeout),
+            timeout=timeout + 5,  # 额外5秒缓冲
+        )
+        self.scraper_requests += 1
+        if self.rate_limiter and resp.status_code in (429, 503):
+            self.rate_limiter.retry_after(url, resp.headers.get("Retry-After"))
+        return resp
+
+    def stats(self):
+        return {
+            "async": self.async_requests,
+            "cloudscraper": self.scraper_requests,
+            "challenges": self.challenges,
+            "clearance_refreshes": self.clearance_refreshes,
+            "metadata": {
+                source: {
+                    "requests": stats["requests"],
+                    "avg_kb": round(stats["bytes"] / stats["requests"] / 1024, 1)
+                    if stats["requests"]
+                    else 0,
+                    "avg_parse_ms": round(stats["parse_seconds"] / stats["requests"] * 1000, 2)
+                    if stats["requests"]
+                    else 0,
+                }
+                for source, stats in self.metadata_stats.items()
+            },
+            "metadata_fallbacks": self.metadata_fallbacks,
+        }
+
     def _full_image_ext_from_thumb(self, thumb_src):
         """Extract the original page extension from a thumbnail URL."""
         filename = os.path.basename(urlparse(thumb_src).path)
@@ -42,6 +234,29 @@ class NHCrawler:
                 return ".jpg" if ext == ".jpeg" else ext
         return ".jpg"
 
+    def thumbnail_url(self, image_url):
+        """由原图链接构造对应的页面缩略图链接
+
+        https://i.nhentai.net/galleries/{media_id}/{page}{ext}
+        -> https://t.nhentai.net/galleries/{media_id}/{page}t{ext}
+        """
+        directory, filename = urlparse(image_url).path.rsplit("/", 1)
+        stem, ext = os.path.splitext(filename)
+        return f"https://t.nhentai.net{directory}/{stem}t{ext}"
+
+    def _html_thumbnail_urls(self, soup):
+        """详情页中各页缩略图的真实链接（如 12t.webp、12t.jpg.webp），取不到的页为 None"""
+        urls = []
+        for thumb in soup.find_all("div", class_="thumb-container"):
+            img_tag = thumb.find("img")
+            src = img_tag and (img_tag.get("data-src") or img_tag.get("src"))
+            if not src or src.startswith("data:"):
+                urls.append(None)
+            else:
+                # 协议相对链接 //t.nhentai.net/... 补全为 https
+                urls.append(urljoin("https://nhentai.net/", src.strip()))
+        return urls
+
     def _normalize_tag_group_name(self, text):
         text = re.sub(r"\s+", " ", text or "").strip().lower()
         if ":" in text:
@@ -204,11 +419,7 @@ class NHCrawler:
         logger.debug(f"正在爬取: {target_url}")
 
         try:
-            # 使用 asyncio.wait_for 包装同步请求，实现超时控制
-            resp = await asyncio.wait_for(
-                asyncio.to_thread(self.scraper.get, target_url, timeout=timeout),
-                timeout=timeout + 5,  # 额外5秒缓冲
-            )
+            resp = await self._fetch(target_url, timeout)
 
             if resp.status_code != 200:
                 logger.warning(f"Failed to fetch page: {resp.status_code}")
@@ -252,6 +463,8 @@ class NHCrawler:
     async def get_gallery_images(self, gid, timeout=30, min_pages=35, max_pages=300):
         """获取本子图片列表和信息
 
+        metadata_source 为 api 时先请求 /api/gallery/{id}，只解析 JSON；失败时回退到 HTML 详情页。
+
         Args:
             gid: 本子ID
             timeout: 请求超时时间（秒）
@@ -265,22 +478,111 @@ class NHCrawler:
         Raises:
             Exception: 网络错误或其他异常，调用者应捕获并决定是否重试
         """
+        if self.metadata_source == "api":
+            try:
+                return await self._get_gallery_api(gid, timeout, min_pages, max_pages)
+            except Exception as e:
+                self.metadata_fallbacks += 1
+                logger.debug(f"[{gid}] API 获取元数据失败，回退到 HTML 详情页: {e}")
+
+        return await self._get_gallery_html(gid, timeout, min_pages, max_pages)
+
+    def _record_metadata(self, source, size, parse_seconds):
+        stats = self.metadata_stats[source]
+        stats["requests"] += 1
+        stats["bytes"] += size
+        stats["parse_seconds"] += parse_seconds
+
+    async def _get_gallery_api(self, gid, timeout, min_pages, max_pages):
+        """通过 /api/gallery/{id} 获取元数据，响应只有 JSON，无需解析 HTML"""
+        url = f"{self.base_url}/api/gallery/{gid}"
+        resp = await self._fetch(url, timeout)
+        if resp.status_code != 200:
+            raise Exception(f"Failed to fetch gallery API: {resp.status_code}")
+
+        started = time.perf_counter()
+        gallery_data = json.loads(resp.text)
+        result = self._parse_gallery_json(gallery_data, min_pages, max_pages, "API")
+        self._record_metadata("api", len(resp.text), time.perf_counter() - started)
+        return result
+
+    async def _get_gallery_html(self, gid, timeout, min_pages, max_pages):
+        """从 HTML 详情页获取元数据"""
         url = f"{self.base_url}/g/{gid}/"
 
         # 移除外层 try-except，让异常抛出以便上层重试
-        resp = await asyncio.wait_for(
-            asyncio.to_thread(self.scraper.get, url, timeout=timeout),
-            timeout=timeout + 5,
-        )
+        resp = await self._fetch(url, timeout)
 
         if resp.status_code != 200:
             raise Exception(f"Failed to fetch gallery page: {resp.status_code}")
 
+        started = time.perf_counter()
+        result = self._parse_gallery_html(resp.text, min_pages, max_pages)
+        self._record_metadata("html", len(resp.text), time.perf_counter() - started)
+        return result
+
+    def _parse_gallery_json(self, gallery_data, min_pages, max_pages, source):
+        """把 nhentai 的本子 JSON（API 响应或页面中的 window._gallery）转换为图片链接与元数据
+
+        Returns:
+            (image_urls, metadata)；被页数过滤时返回 None
+
+        Raises:
+            ValueError: JSON 中没有可用的页面
+        """
+        media_id = gallery_data.get("media_id")
+        logger.debug(f"解析到 Media ID ({source}): {media_id}")
+
+        images = gallery_data.get("images", {}).get("pages", [])
+
+        if self._is_page_count_filtered(len(images), min_pages, max_pages, f"{source}解析"):
+            return None  # 返回 None 表示被过滤，无需重试
+
+        image_urls = []
+        thumbnail_urls = []
+
+        for i, img_data in enumerate(images, 1):
+            t = img_data.get("t")
+            ext = ".jpg"
+            if t == "j":
+                ext = ".jpg"
+            elif t == "p":
+                ext = ".png"
+            elif t == "w":
+                ext = ".webp"
+            elif t == "g":
+                ext = ".gif"
+
+            # 官方图片服务器: https://i.nhentai.net/galleries/{media_id}/{page}{ext}
+            real_url = f"https://i.nhentai.net/galleries/{media_id}/{i}{ext}"
+            image_urls.append(real_url)
+            thumbnail_urls.append(f"https://t.nhentai.net/galleries/{media_id}/{i}t{ext}")
+
+        if not media_id or not image_urls:
+            raise ValueError("gallery JSON has no pages")
+
+        # 提取元数据：只保留可读且适合展示的标签类型，排除 language/category/pages 等统计项。
+        tags = self._extract_json_tags(gallery_data)
+
+        metadata = {
+            "title": gallery_data.get("title", {}).get("pretty")
+            or gallery_data.get("title", {}).get("english"),
+            "page_count": len(images),
+            "tags": tags,
+            "media_id": str(media_id),
+            "thumbnail_urls": thumbnail_urls,
+        }
+
+        logger.debug(f"通过 {source} 解析构造了 {len(image_urls)} 个图片链接。")
+        return image_urls, metadata
+
+    def _parse_gallery_html(self, text, min_pages, max_pages):
+        """解析 HTML 详情页：优先读取页面中的 window._gallery JSON，失败时解析 HTML"""
         # 尝试通过 regex 直接解析 window._gallery JSON 数据，这是最准确的方法
         # 格式通常是: window._gallery = JSON.parse("...");
         try:
             gallery_match = re.search(
-                r"window\._gallery\s*=\s*JSON\.parse\((.*?)\);", resp.text, re.DOTALL
+                r"window\._gallery\s*=\s*JSON\.parse\((.*?)\);", text, re.DOTALL
             )
             if gallery_match:
                 raw_json_str = gallery_match.group(1)
@@ -291,53 +593,19 @@ class NHCrawler:
                 else:
                     gallery_data = first_parse
 
-                media_id = gallery_data.get("media_id")
-                logger.debug(f"解析到 Media ID (JSON): {media_id}")
-
-                images = gallery_data.get("images", {}).get("pages", [])
-
-                if self._is_page_count_filtered(
-                    len(images), min_pages, max_pages, "JSON解析"
-                ):
-                    return None  # 返回 None 表示被过滤，无需重试
-
-                image_urls = []
-
-                for i, img_data in enumerate(images, 1):
-                    t = img_data.get("t")
-                    ext = ".jpg"
-                    if t == "j":
-                        ext = ".jpg"
-                    elif t == "p":
-                        ext = ".png"
-                    elif t == "w":
-                        ext = ".webp"
-                    elif t == "g":
-                        ext = ".gif"
-
-                    # 官方图片服务器: https://i.nhentai.net/galleries/{media_id}/{page}{ext}
-                    real_url = f"https://i.nhentai.net/galleries/{media_id}/{i}{ext}"
-                    image_urls.append(real_url)
-
-                # 提取元数据：只保留可读且适合展示的标签类型，排除 language/category/pages 等统计项。
-                tags = self._extract_json_tags(gallery_data)
-
-                metadata = {
-                    "title": gallery_data.get("title", {}).get("pretty")
-                    or gallery_data.get("title", {}).get("english"),
-                    "page_count": len(images),
-                    "tags": tags,
-                }
-
-                if image_urls:
-                    logger.debug(f"通过 JSON 解析构造了 {len(image_urls)} 个图片链接。")
-                    return image_urls, metadata
+                result = self._parse_gallery_json(gallery_data, min_pages, max_pages, "JSON")
+                if result:
+                    # JSON 只有原图格式，缩略图的实际格式可能不同，以页面中的缩略图链接为准
+                    html_thumbs = self._html_thumbnail_urls(BeautifulSoup(text, "html.parser"))
+                    if len(html_thumbs) == len(result[0]):
+                        result[1]["thumbnail_urls"] = html_thumbs
+                return result
 
         except Exception as e:
             logger.debug(f"JSON 解析失败，尝试 HTML 解析回退方案: {e}")
 
         # === 回退方案: HTML 解析 (旧逻辑) ===
-        soup = BeautifulSoup(resp.text, "html.parser")
+        soup = BeautifulSoup(text, "html.parser")
 
         cover_img = soup.find("div", id="cover").find("img")
         if not cover_img:
@@ -359,11 +627,9 @@ class NHCrawler:
             return None
 
         image_urls = []
-        for i, thumb in enumerate(thumbs, 1):
-            img_tag = thumb.find("img")
-            thumb_src = img_tag.get("data-src") or img_tag.get("src")
-
-            ext = self._full_image_ext_from_thumb(thumb_src)
+        thumbnail_urls = self._html_thumbnail_urls(soup)
+        for i, thumb_src in enumerate(thumbnail_urls, 1):
+            ext = self._full_image_ext_from_thumb(thumb_src or "")
 
             real_url = f"https://i.nhentai.net/galleries/{media_id}/{i}{ext}"
             image_urls.append(real_url)
@@ -371,6 +637,11 @@ class NHCrawler:
         # HTML 提取 tags。nhentai 会把 Pages/Uploaded 也做成 tag 样式，必须按分组过滤。
         tags = self._extract_html_tags(soup)
 
-        metadata = {"page_count": len(thumbs), "tags": tags}
+        metadata = {
+            "page_count": len(thumbs),
+            "tags": tags,
+            "media_id": media_id,
+            "thumbnail_urls": thumbnail_urls,
+        }
 
         return image_urls, metadata
@@ -0,0 +1,141 @@
+import io
+import hashlib
+import threading
+from collections import OrderedDict
+from PIL import Image, ImageStat
+
+
+class ContentHashCache:
+    """按图片内容 SHA-1 缓存逐页原始结果（跨本子共享，线程安全，LRU 淘汰）。
+
+    汉化组的制作人员页、水印页等会原样出现在很多本子里，命中后无需再推理。
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, digest):
+        with self._lock:
+            record = self._entries.get(digest)
+            if record is not None:
+                self._entries.move_to_end(digest)
+            return record
+
+    def put(self, digest, record):
+        with self._lock:
+            self._entries[digest] = record
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def dhash(gray_thumb):
+    """对灰度缩略图计算 64 位差值哈希"""
+    small = gray_thumb.resize((9, 8), Image.Resampling.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class PageDeduper:
+    """单个本子内的页面去重。
+
+    在模型推理之前依次检查：
+    1. 内容完全相同（SHA-1 命中共享缓存）→ 复用结果
+    2. 近乎空白（灰度标准差很低）→ 直接判为非 NSFW
+    3. 与本子内已推理页面的感知哈希距离很近 → 复用该页结果
+    """
+
+    # 缩略图尺寸，用于空白检测与感知哈希
+    THUMB_SIZE = (32, 32)
+
+    def __init__(self, content_cache=None, max_distance=4, blank_stddev=4.0):
+        self.content_cache = content_cache
+        self.max_distance = max_distance
+        self.blank_stddev = blank_stddev
+        self._pages = []  # 需推理的页面 [phash, digest, record]，下标即 token
+        self.skipped_exact = 0
+        self.skipped_similar = 0
+        self.skipped_blank = 0
+
+    def lookup(self, data, image=None):
+        """
+        检查一页图片是否可以跳过推理
+
+        Args:
+            data: 图片文件的原始字节
+            image: 可选，已解码的 PIL 图片；传入时直接用它生成缩略图，避免再次解码
+
+        Returns:
+            (status, value):
+            - ("hit", record): 直接复用 record
+            - ("follow", token): 与某个待推理/已推理页面近似，推理完成后用 record(token) 取结果
+            - ("infer", token): 需要推理，推理后调用 remember(token, record)
+        """
+        digest = hashlib.sha1(data).hexdigest()
+        if self.content_cache is not None:
+            record = self.content_cache.get(digest)
+            if record is not None:
+                self.skipped_exact += 1
+                return "hit", record
+
+        phash = None
+        try:
+            gray = self._gray_thumb(data, image)
+            if ImageStat.Stat(gray).stddev[0] < self.blank_stddev:
+                self.skipped_blank += 1
+                return "hit", []
+
+            phash = dhash(gray)
+            if self.max_distance > 0:
+                for token, (seen_hash, _, _) in enumerate(self._pages):
+                    if seen_hash is not None and hamming(phash, seen_hash) <= self.max_distance:
+                        self.skipped_similar += 1
+                        return "follow", token
+        except Exception:
+            # 感知哈希失败不影响推理，交给模型处理
+            pass
+
+        self._pages.append([phash, digest, None])
+        return "infer", len(self._pages) - 1
+
+    def remember(self, token, record):
+        """记录一页的推理结果，供后续页面复用"""
+        entry = self._pages[token]
+        entry[2] = record
+        if self.content_cache is not None and record is not None:
+            self.content_cache.put(entry[1], record)
+
+    def record(self, token):
+        """返回某个已推理页面的结果；推理失败时为 None"""
+        return self._pages[token][2]
+
+    def _gray_thumb(self, data, image=None):
+        if image is not None:
+            return image.convert('L').resize(self.THUMB_SIZE, Image.Resampling.BILINEAR)
+        with Image.open(io.BytesIO(data)) as img:
+            # JPEG 可在解码时直接按比例缩小，避免全尺寸解码
+            img.draft('L', self.THUMB_SIZE)
+            return img.convert('L').resize(self.THUMB_SIZE, Image.Resampling.BILINEAR)
+
+    def stats(self):
+        return {
+            "skipped_exact": self.skipped_exact,
+            "skipped_similar": self.skipped_similar,
+            "skipped_blank": self.skipped_blank,
+        }
@@ -0,0 +1,284 @@
+import os
+import re
+import json
+import glob
+import hashlib
+import threading
+import time
+import numpy as np
+
+# 关键词，根据模型不同可能需要调整
+# EraX 这类模型通常会有 explicit, nsfw, porn 等标签
+NSFW_KEYWORDS = ['nsfw', 'porn', 'hentai', 'sexual', 'explicit', 'sex']
+
+# EraX-NSFW-V1.0 模型定义的标签:
+# anus, make_love, nipple, penis, vagina
+# 只要检测到 make_love (交合) 或 penis/vagina/anus (关键部位) 即视为 NSFW 页
+# nipple 单独出现可能只是擦边，但也计入 NSFW
+YOLO_NSFW_LABELS = ['make_love', 'penis', 'vagina', 'anus', 'nipple']
+
+# 判定策略
+POLICY_TRANSFORMERS = 'transformers'
+POLICY_YOLO_CLASSIFY = 'yolo-classify'
+POLICY_YOLO_DETECT = 'yolo-detect'
+
+
+def is_nsfw_page(policy, names, record, threshold):
+    """
+    根据逐页原始结果判断是否为 NSFW 页，实时推理与离线重算共用这一套规则
+
+    Args:
+        policy: 判定策略，见 POLICY_*
+        names: {class_id: label} 标签表
+        record: [(class_id, conf), ...]，分类模型为 top-k 结果，检测模型为全部检测框；None 表示无效图片
+        threshold: 检测阈值
+    """
+    if not record:
+        return False
+
+    if policy == POLICY_YOLO_DETECT:
+        for cls_id, conf in record:
+            label = str(names.get(cls_id, '')).lower()
+            if conf > threshold and any(k in label for k in YOLO_NSFW_LABELS):
+                return True
+        return False
+
+    cls_id, score = max(record, key=lambda item: item[1])
+    label = str(names.get(cls_id, '')).lower()
+
+    if policy == POLICY_YOLO_CLASSIFY:
+        return any(k in label for k in NSFW_KEYWORDS)
+
+    # Transformers: 检查 top1
+    if any(k in label for k in NSFW_KEYWORDS) and score > threshold:
+        return True
+    elif label == 'normal' or label == 'safe':
+        return False
+    # 如果 top1 不是 safe 且分数很高，也算
+    return score > 0.8
+
+
+def is_ambiguous_page(policy, names, record, threshold, band):
+    """
+    判断单页结果是否落在判定边界附近（±band），用于缩略图评分时决定是否用原图复核
+
+    检测模型看 NSFW 检测框的置信度是否接近阈值；分类模型看 top1 与 top2 是否接近，
+    Transformers 的 NSFW 标签还要看分数是否接近阈值。无效图片视为模糊。
+    """
+    if record is None:
+        return True
+    if band <= 0:
+        return False
+
+    if policy == POLICY_YOLO_DETECT:
+        for cls_id, conf in record:
+            label = str(names.get(cls_id, '')).lower()
+            if any(k in label for k in YOLO_NSFW_LABELS) and abs(conf - threshold) <= band:
+                return True
+        return False
+
+    if not record:
+        return True
+    ranked = sorted(record, key=lambda item: item[1], reverse=True)
+    if len(ranked) > 1 and ranked[0][1] - ranked[1][1] <= band:
+        return True
+
+    cls_id, score = ranked[0]
+    label = str(names.get(cls_id, '')).lower()
+    if policy == POLICY_TRANSFORMERS and any(k in label for k in NSFW_KEYWORDS):
+        return abs(score - threshold) <= band
+    return False
+
+
+def page_number(img_path):
+    """从图片文件名 (例如 12.jpg / 12t.jpg) 中解析页码，解析失败返回 0"""
+    match = re.match(r"(\d+)", os.path.basename(img_path))
+    return int(match.group(1)) if match else 0
+
+
+class GalleryDetections:
+    """单个本子逐页原始检测结果的收集器（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records = {}
+
+    def add(self, page_no, record):
+        """记录某页的原始结果；record 为 None 表示无效图片，原样保留以便缩略图评分复核该页"""
+        with self._lock:
+            self._records[page_no] = None if record is None else list(record)
+
+    def get(self, page_no):
+        """返回某页的原始结果，未记录或无效图片时返回 None"""
+        with self._lock:
+            return self._records.get(page_no)
+
+    def __len__(self):
+        return len(self._records)
+
+    def to_arrays(self):
+        """转换为列存数组：每页一行 (pages, counts)，所有检测框平铺 (cls, conf)"""
+        with self._lock:
+            items = sorted(self._records.items())
+
+        pages = np.array([page for page, _ in items], dtype=np.int32)
+        # 无效图片按没有任何结果保存，重算时同样判为非 NSFW 页
+        counts = np.array([len(record or []) for _, record in items], dtype=np.int32)
+        flat = [item for _, record in items for item in record or []]
+        cls = np.array([int(c) for c, _ in flat], dtype=np.int16)
+        conf = np.array([float(p) for _, p in flat], dtype=np.float32)
+        return pages, counts, cls, conf
+
+
+class DetectionStore:
+    """逐页原始检测结果的磁盘存储。
+
+    每个本子一个 .npz 文件，按模型指纹分目录，键不含阈值；换阈值或判定规则时可直接重算分数而无需重新推理。
+    """
+
+    # 每保存多少个本子清理一次；清理需要遍历整个目录，不在每次保存时进行
+    PRUNE_EVERY = 50
+
+    def __init__(self, root_dir, ttl_seconds=72 * 3600, max_entries=5000):
+        self.root_dir = root_dir
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._saves = 0
+
+    def _model_dir(self, model_fingerprint):
+        digest = hashlib.sha1(model_fingerprint.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.root_dir, digest)
+
+    def _path(self, gid, media_id, model_fingerprint):
+        return os.path.join(
+            self._model_dir(model_fingerprint), f"{gid}_{media_id}.npz"
+        )
+
+    def save(self, gid, media_id, model_fingerprint, policy, names, detections):
+        """保存一个本子的逐页原始结果，写入临时文件后原子替换"""
+        if not len(detections):
+            return
+
+        path = self._path(gid, media_id, model_fingerprint)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        pages, counts, cls, conf = detections.to_arrays()
+        meta = {
+            "gid": str(gid),
+            "media_id": str(media_id),
+            "model": model_fingerprint,
+            "policy": policy,
+            "names": {str(k): v for k, v in (names or {}).items()},
+            "created_at": time.time(),
+        }
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                pages=pages,
+                counts=counts,
+                cls=cls,
+                conf=conf,
+                meta=np.array(json.dumps(meta, ensure_ascii=False)),
+            )
+        os.replace(tmp_path, path)
+        # 启动后第一次保存时清理一次，之后每 PRUNE_EVERY 次清理一次
+        if self._saves % self.PRUNE_EVERY == 0:
+            self.prune()
+        self._saves += 1
+
+    def load(self, path):
+        """读取一个 .npz 文件，返回 (meta, pages, counts, cls, conf)"""
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            meta["names"] = {int(k): v for k, v in meta["names"].items()}
+            return meta, data['pages'], data['counts'], data['cls'], data['conf']
+
+    def rescore_file(self, path, threshold):
+        """用给定阈值重算一个本子的 (score, stats)"""
+        meta, pages, counts, cls, conf = self.load(path)
+        total_pages = len(pages)
+        if total_pages == 0:
+            return 0, {}
+
+        policy = meta["policy"]
+        names = meta["names"]
+        if policy == POLICY_YOLO_DETECT:
+            # 检测模式可以整体向量化：标签命中且置信度超过阈值的框所在页即为 NSFW 页
+            nsfw_ids = [
+                cls_id for cls_id, label in names.items()
+                if any(k in str(label).lower() for k in YOLO_NSFW_LABELS)
+            ]
+            hit = np.isin(cls, nsfw_ids) & (conf > threshold)
+            page_index = np.repeat(np.arange(total_pages), counts)
+            hentai_pages = int(np.unique(page_index[hit]).size)
+        else:
+            hentai_pages = 0
+            offsets = np.concatenate(([0], np.cumsum(counts)))
+            for i in range(total_pages):
+                start, end = offsets[i], offsets[i + 1]
+                record = list(zip(cls[start:end].tolist(), conf[start:end].tolist()))
+                if is_nsfw_page(policy, names, record, threshold):
+                    hentai_pages += 1
+
+        score = (hentai_pages / total_pages) * 100
+        stats = {"total": total_pages, "hentai": hentai_pages}
+        return score, stats
+
+    def rescore(self, gid, media_id, model_fingerprint, threshold):
+        """
+        从已保存的原始结果重算评分
+
+        Returns:
+            (score, stats)；没有记录或已过期时返回 None
+        """
+        path = self._path(gid, media_id, model_fingerprint)
+        if not os.path.exists(path):
+            return None
+        if time.time() - os.path.getmtime(path) > self.ttl_seconds:
+            return None
+        return self.rescore_file(path, threshold)
+
+    def iter_files(self, model_fingerprint=None):
+        """列出保存的 .npz 文件；给出模型指纹时只列出该模型的结果"""
+        model_dir = self._model_dir(model_fingerprint) if model_fingerprint else os.path.join(self.root_dir, '*')
+        return sorted(glob.glob(os.path.join(model_dir, '*.npz')))
+
+    def models(self):
+        """返回 {模型指纹: 文件数}，按最近写入时间从新到旧排列"""
+        latest = {}
+        counts = {}
+        for path in self.iter_files():
+            try:
+                model = self.load(path)[0]["model"]
+                mtime = os.path.getmtime(path)
+            except Exception:
+                continue
+            counts[model] = counts.get(model, 0) + 1
+            latest[model] = max(latest.get(model, 0), mtime)
+        return {model: counts[model] for model in sorted(latest, key=latest.get, reverse=True)}
+
+    def prune(self):
+        """删除过期文件，超过数量上限时删除最旧的文件"""
+        now = time.time()
+        files = []
+        for path in self.iter_files():
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            if now - mtime > self.ttl_seconds:
+                self._remove(path)
+            else:
+                files.append((mtime, path))
+
+        if self.max_entries > 0 and len(files) > self.max_entries:
+            files.sort()
+            for _, path in files[:len(files) - self.max_entries]:
+                self._remove(path)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
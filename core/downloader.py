@@ -1,13 +1,88 @@
 import os
+import time
 import aiohttp
 import asyncio
+from contextlib import aclosing
 from astrbot.api import logger
+from .concurrency import AIMDLimiter
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36",
+    "Accept": "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8",
+    "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
+    "Referer": "https://nhentai.net/",
+    "Sec-Fetch-Dest": "image",
+    "Sec-Fetch-Mode": "no-cors",
+    "Sec-Fetch-Site": "same-site"
+}
+
+# 分块读取响应体的块大小
+CHUNK_SIZE = 128 * 1024
+
+
+class DownloadLimitError(Exception):
+    """页面超过单页大小上限或本子下载预算，不再重试"""
+
+
+class ByteBudget:
+    """
+    单个本子的下载字节预算（按网络传输的原始字节计），该本子的所有下载（含补救）共用
+
+    每页开始传输前按 Content-Length 预留额度，预留不到时该页不开始并标记预算已用完；
+    已经开始传输的页面不会因预算被中止，预算限制的是下载量，而不是把进行中的页面一起丢弃。
+    """
+
+    def __init__(self, limit_bytes):
+        self.limit_bytes = limit_bytes
+        self.used = 0  # 已传输的字节
+        self.reserved = 0  # 进行中的页面已预留、尚未传输的字节
+        self.exceeded = False
+
+    def reserve(self, size):
+        """页面开始传输前预留 size 字节（Content-Length 未知时为 0），预算不足时返回 False"""
+        if self.exceeded or self.used + self.reserved + size > self.limit_bytes:
+            self.exceeded = True
+            return False
+        self.reserved += size
+        return True
+
+    def consume(self, size, reserved=0):
+        """记入已传输的字节，其中 reserved 字节来自该页的预留额度"""
+        self.used += size
+        self.reserved -= reserved
+        if self.used >= self.limit_bytes:
+            self.exceeded = True
+
+    def release(self, size):
+        """归还页面未用完的预留额度（传输失败或实际大小小于 Content-Length）"""
+        self.reserved -= size
+
 
 class ImageDownloader:
-    def __init__(self, max_concurrency=6, proxy=None):
-        self.semaphore = asyncio.Semaphore(max_concurrency)
-        self.max_concurrency = max_concurrency
+    def __init__(
+        self,
+        max_concurrency=6,
+        proxy=None,
+        ingestor=None,
+        http_pool=None,
+        limiter=None,
+        rate_limiter=None,
+        max_page_bytes=0,
+        mirrors=None,
+    ):
+        # 自适应并发控制（AIMDLimiter），可由调用方传入以便多个本子共享；max_concurrency 为未传入时的初始并发
+        self.limiter = limiter or AIMDLimiter(initial=max_concurrency)
         self.proxy = proxy
+        # 可选的入库转码（PageIngestor），下载后先缩小再写盘或交给分析
+        self.ingestor = ingestor
+        # 可选的共享连接池（HttpPool）；未传入时每次 download_images 使用独立会话
+        self.http_pool = http_pool
+        # 可选的按主机限速（HostRateLimiter），与爬虫共用
+        self.rate_limiter = rate_limiter
+        # 单页大小上限（字节），0 表示不限制
+        self.max_page_bytes = max_page_bytes
+        # 可选的图片服务器镜像池（MirrorPool）：每次尝试发往最健康的主机，失败后换主机重试
+        self.mirrors = mirrors
         # 如果未传入，尝试从环境变量读取
         if not self.proxy:
             self.proxy = os.environ.get("HTTP_PROXY") or os.environ.get("HTTPS_PROXY")
@@ -18,62 +93,228 @@ class ImageDownloader:
             logger.debug("下载器未使用代理。如果下载失败，请检查网络连接或配置代理。")
 
     def _write_file(self, path, content):
-        """同步写入文件（将在线程中运行）"""
-        with open(path, 'wb') as f:
+        """同步写入文件（将在线程中运行）；先写临时文件再原子替换，半截文件不会被当成已下载的页面"""
+        part_path = path + ".part"
+        with open(part_path, 'wb') as f:
             f.write(content)
+        os.replace(part_path, path)
+
+    async def _iter_body(self, response, budget=None):
+        """分块读取响应体；超过单页上限或预留不到本子预算时抛出 DownloadLimitError
+
+        需配合 contextlib.aclosing 使用，确保中途退出时归还未用完的预算预留。
+        """
+        content_length = response.content_length or 0
+        if self.max_page_bytes and content_length > self.max_page_bytes:
+            raise DownloadLimitError(
+                f"页面大小 {content_length} 字节超过上限 {self.max_page_bytes}"
+            )
+        if budget is not None and not budget.reserve(content_length):
+            raise DownloadLimitError(f"本子下载量超过预算 {budget.limit_bytes} 字节")
+        reserved = content_length if budget is not None else 0
+        size = 0
+        try:
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                size += len(chunk)
+                if self.max_page_bytes and size > self.max_page_bytes:
+                    raise DownloadLimitError(f"页面大小超过上限 {self.max_page_bytes} 字节")
+                if budget is not None:
+                    covered = min(reserved, len(chunk))
+                    reserved -= covered
+                    budget.consume(len(chunk), covered)
+                yield chunk
+        finally:
+            if reserved:
+                budget.release(reserved)
+
+    async def _stream_to_file(self, response, path, budget=None):
+        """
+        边下载边写入临时文件，完成后原子替换为目标文件；失败时删除临时文件
+
+        启用入库转码时由转码线程池从临时文件解码、缩小后再替换，整页同样不在内存中缓冲
+        """
+        part_path = path + ".part"
+        f = await asyncio.to_thread(open, part_path, 'wb')
+        try:
+            try:
+                async with aclosing(self._iter_body(response, budget)) as body:
+                    async for chunk in body:
+                        await asyncio.to_thread(f.write, chunk)
+            finally:
+                await asyncio.to_thread(f.close)
+            if self.ingestor:
+                # 1.xxx 为封面，保留卡片所需的分辨率
+                is_cover = os.path.splitext(os.path.basename(path))[0] == "1"
+                await self.ingestor.process_file(part_path, path, cover=is_cover)
+            else:
+                os.replace(part_path, path)
+        except BaseException:
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
+            raise
+
+    async def download_image(
+        self,
+        session,
+        url,
+        save_path,
+        retries=3,
+        on_page=None,
+        memory=None,
+        persist=False,
+        budget=None,
+    ):
+        use_mirrors = self.mirrors is not None and self.mirrors.applies(url)
+        tried = set()
+        for i in range(retries):
+            if budget is not None and budget.exceeded:
+                return False
+
+            # 每次尝试单独占用并发名额，重试前的等待不占名额；结果反馈给并发控制器
+            async with self.limiter.slot() as slot:
+                # 拿到名额后再选主机，启用镜像池时发往当前最健康、且本页还没试过的主机
+                request_url = url
+                host = None
+                if use_mirrors:
+                    host = self.mirrors.choose(exclude=tried)
+                    tried.add(host)
+                    request_url = self.mirrors.rewrite(url, host)
+                    self.mirrors.begin(host)
+                host_ok = None
+                host_miss = False
+                latency = None
 
-    async def download_image(self, session, url, save_path, retries=2):
-        async with self.semaphore:
-            for i in range(retries):
                 try:
+                    if self.rate_limiter:
+                        await self.rate_limiter.acquire(request_url)
+                    started = time.monotonic()
                     # 使用配置的代理进行下载
-                    async with session.get(url, timeout=30, proxy=self.proxy) as response:
+                    async with session.get(
+                        request_url, headers=HEADERS, timeout=30, proxy=self.proxy
+                    ) as response:
                         if response.status == 200:
-                            content = await response.read()
-                            # 使用 asyncio.to_thread 进行非阻塞文件写入
-                            await asyncio.to_thread(self._write_file, save_path, content)
-                            logger.debug(f"下载成功: {url}")
+                            # 以首字节延迟衡量拥塞，与图片大小无关
+                            latency = time.monotonic() - started
+                            if memory is None:
+                                # 直接分块写盘（需要时再从临时文件转码），整页不在内存中缓冲
+                                await self._stream_to_file(response, save_path, budget)
+                                slot.success(latency)
+                                host_ok = True
+                            else:
+                                # 内存模式需要完整的页面字节，分块读取时同样受大小上限约束
+                                async with aclosing(self._iter_body(response, budget)) as body:
+                                    content = b''.join([chunk async for chunk in body])
+                                slot.success(latency)
+                                host_ok = True
+                                if self.ingestor:
+                                    # 1.xxx 为封面，保留卡片所需的分辨率
+                                    is_cover = os.path.splitext(os.path.basename(save_path))[0] == "1"
+                                    content = await self.ingestor.process(content, cover=is_cover)
+                                if memory is None or persist:
+                                    # 使用 asyncio.to_thread 进行非阻塞文件写入
+                                    await asyncio.to_thread(self._write_file, save_path, content)
+                            logger.debug(f"下载成功: {request_url}")
+                            if memory is not None:
+                                # 内存模式：等到内存预算有空余再交出原始字节，等待期间占着并发槽位形成背压
+                                await memory.acquire(os.path.basename(save_path), len(content))
+                                if on_page:
+                                    on_page(url, content)
+                            elif on_page:
+                                on_page(url, save_path)
                             return True
                         elif response.status == 404:
-                            logger.debug(f"下载失败 {url}: 404 Not Found (不再重试)")
+                            # 镜像可能尚未同步该页，记为一次缺页并换一个主机再试；没有其他主机时不再重试
+                            host_miss = True
+                            if use_mirrors and self.mirrors.has_untried(tried):
+                                logger.debug(f"下载失败 {request_url}: 404 Not Found，换主机重试")
+                                continue
+                            logger.debug(f"下载失败 {request_url}: 404 Not Found (不再重试)")
                             return False
                         else:
-                            logger.debug(f"下载失败 {url}: Status {response.status} (重试 {i+1}/{retries})")
+                            host_ok = False
+                            if response.status == 429 or response.status >= 500:
+                                slot.congested()
+                            if self.rate_limiter and response.status in (429, 503):
+                                self.rate_limiter.retry_after(
+                                    request_url, response.headers.get("Retry-After")
+                                )
+                            logger.debug(f"下载失败 {request_url}: Status {response.status} (重试 {i+1}/{retries})")
+                except DownloadLimitError as e:
+                    # 超出本子预算时由调用方统一提示，这里不逐页告警
+                    if budget is not None and budget.exceeded:
+                        logger.debug(f"跳过 {url}: {e}")
+                    else:
+                        logger.warning(f"跳过 {url}: {e}")
+                    return False
                 except Exception as e:
-                    logger.debug(f"下载异常 {url}: {e} (重试 {i+1}/{retries})")
-                
-                # 如果不是最后一次尝试，稍微等待一下
-                if i < retries - 1:
-                    await asyncio.sleep(1)
-            
-            return False
+                    # 超时、连接错误视为拥塞信号；已成功取回的页面在后续处理中出错不算主机故障
+                    if host_ok is None:
+                        host_ok = False
+                    slot.congested()
+                    logger.debug(f"下载异常 {request_url}: {e} (重试 {i+1}/{retries})")
+                finally:
+                    if host is not None:
+                        self.mirrors.end(host, host_ok, latency, miss=host_miss)
+
+            # 如果不是最后一次尝试，等待一下，越往后等得越久；还有没试过的镜像时直接换主机
+            if i < retries - 1 and not (use_mirrors and self.mirrors.has_untried(tried)):
+                await asyncio.sleep(i + 1)
+
+        return False
 
-    async def download_images(self, urls, output_dir):
+    async def _download_all(self, session, urls, output_dir, on_page, memory, persist, budget):
+        tasks = []
+        items = []
+        for url in urls:
+            # 从 URL 中提取文件名 (例如 1.jpg)
+            filename = url.split('/')[-1]
+            save_path = os.path.join(output_dir, filename)
+            task = asyncio.create_task(
+                self.download_image(
+                    session,
+                    url,
+                    save_path,
+                    on_page=on_page,
+                    memory=memory,
+                    persist=url in persist,
+                    budget=budget,
+                )
+            )
+            tasks.append(task)
+            items.append((url, save_path))
+
+        results = await asyncio.gather(*tasks)
+        return items, results
+
+    async def download_images(
+        self, urls, output_dir, on_page=None, memory=None, persist=(), budget=None
+    ):
+        """下载一组图片到 output_dir
+
+        Args:
+            urls: 图片链接列表
+            output_dir: 保存目录
+            on_page: 可选回调 on_page(url, save_path)，每张图片写入完成后立即调用，用于流式分析；
+                内存模式下为 on_page(url, content)
+            memory: 可选，MemoryLedger。传入时为内存模式：图片不写盘，原始字节经内存预算直接交给 on_page
+            persist: 内存模式下仍需写盘的链接（如封面）
+            budget: 可选，ByteBudget。预留不到预算的页面不再下载，已开始传输的页面照常完成
+        """
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
         
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36",
-            "Accept": "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8",
-            "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
-            "Referer": "https://nhentai.net/",
-            "Sec-Fetch-Dest": "image",
-            "Sec-Fetch-Mode": "no-cors",
-            "Sec-Fetch-Site": "same-site"
-        }
-
-        async with aiohttp.ClientSession(headers=headers) as session:
-            tasks = []
-            items = []
-            for url in urls:
-                # 从 URL 中提取文件名 (例如 1.jpg)
-                filename = url.split('/')[-1]
-                save_path = os.path.join(output_dir, filename)
-                task = asyncio.create_task(self.download_image(session, url, save_path))
-                tasks.append(task)
-                items.append((url, save_path))
-            
-            results = await asyncio.gather(*tasks)
+        if self.http_pool:
+            session = await self.http_pool.session()
+            items, results = await self._download_all(
+                session, urls, output_dir, on_page, memory, persist, budget
+            )
+        else:
+            async with aiohttp.ClientSession() as session:
+                items, results = await self._download_all(
+                    session, urls, output_dir, on_page, memory, persist, budget
+                )
 
         failed = [
             {"url": url, "path": save_path}
@@ -0,0 +1,72 @@
+import asyncio
+import aiohttp
+from astrbot.api import logger
+
+
+class HttpPool:
+    """
+    插件生命周期内共享的 aiohttp 会话与连接池
+
+    所有本子的下载（含封面、缺页补救）复用同一组长连接，不必每个本子都重新握手 TCP/TLS（含代理隧道）。
+    会话在首次使用时于当前事件循环中创建，插件卸载时关闭。
+    """
+
+    def __init__(self, limit=64, limit_per_host=16, keepalive_timeout=30, dns_ttl=300):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_ttl = dns_ttl
+        self._session = None
+        self._lock = asyncio.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+
+    def _trace_config(self):
+        trace = aiohttp.TraceConfig()
+
+        async def on_request_start(session, context, params):
+            self.requests += 1
+
+        async def on_connection_create_end(session, context, params):
+            self.new_connections += 1
+
+        async def on_connection_reuseconn(session, context, params):
+            self.reused_connections += 1
+
+        trace.on_request_start.append(on_request_start)
+        trace.on_connection_create_end.append(on_connection_create_end)
+        trace.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace
+
+    async def session(self):
+        """返回共享会话；尚未创建或已关闭时新建"""
+        async with self._lock:
+            if self._session is None or self._session.closed:
+                connector = aiohttp.TCPConnector(
+                    limit=self.limit,
+                    limit_per_host=self.limit_per_host,
+                    keepalive_timeout=self.keepalive_timeout,
+                    ttl_dns_cache=self.dns_ttl,
+                )
+                self._session = aiohttp.ClientSession(
+                    connector=connector, trace_configs=[self._trace_config()]
+                )
+                logger.debug(
+                    f"已创建共享 HTTP 连接池 (limit={self.limit}, limit_per_host={self.limit_per_host})"
+                )
+            return self._session
+
+    def stats(self):
+        connections = self.new_connections + self.reused_connections
+        return {
+            "requests": self.requests,
+            "new": self.new_connections,
+            "reused": self.reused_connections,
+            "reuse_ratio": round(self.reused_connections / connections, 2) if connections else 0,
+        }
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
@@ -0,0 +1,124 @@
+import collections
+import io
+import math
+import numpy as np
+from PIL import Image
+
+
+def load_page(source, long_edge=None, short_edge=None):
+    """
+    读取并解码一页图片，只解码一次，并尽量在解码阶段缩小到接近模型输入尺寸
+
+    JPEG 使用 draft 模式让解码器直接按 1/2、1/4、1/8 缩小；其他格式解码后用 reduce() 整数倍缩小。
+    两种方式都保证缩小后长边不小于 long_edge、短边不小于 short_edge，精确缩放仍交给模型预处理。
+    损坏或不完整的文件会在解码时抛出异常。
+
+    Args:
+        source: 图片路径或原始字节
+        long_edge: 可选，缩小后长边的下限（如 YOLO 的 imgsz）
+        short_edge: 可选，缩小后短边的下限（如分类模型的输入尺寸）
+
+    Returns:
+        (data, image): 原始字节与解码后的 RGB PIL 图片
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = bytes(source)
+    else:
+        with open(source, 'rb') as f:
+            data = f.read()
+
+    img = Image.open(io.BytesIO(data))
+    scale = _target_scale(img.size, long_edge, short_edge)
+
+    if scale < 1 and img.format == 'JPEG':
+        width, height = img.size
+        img.draft('RGB', (math.ceil(width * scale), math.ceil(height * scale)))
+
+    img.load()
+
+    # draft 之后尺寸已变化，按当前尺寸重新计算剩余的整数缩小倍数
+    scale = _target_scale(img.size, long_edge, short_edge)
+    factor = int(1 / scale) if scale < 1 else 1
+    if factor >= 2:
+        img = img.reduce(factor)
+
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    return data, img
+
+
+def _target_scale(size, long_edge, short_edge):
+    width, height = size
+    if not width or not height:
+        return 1.0
+    scales = []
+    if long_edge:
+        scales.append(long_edge / max(width, height))
+    if short_edge:
+        scales.append(short_edge / min(width, height))
+    return max(scales) if scales else 1.0
+
+
+def to_bgr_array(img):
+    """RGB PIL 图片转为 YOLO 期望的 HWC BGR uint8 数组"""
+    return np.ascontiguousarray(np.asarray(img)[:, :, ::-1])
+
+
+class PagePrefetcher:
+    """
+    在线程池中提前解码页面（双缓冲）
+
+    当前批次推理时，后续页面已在线程池中解码；PIL 解码会释放 GIL，多核 CPU 上可与推理并行。
+    结果按提交顺序取回，未取走的任务最多 capacity 个，用于限制内存占用。
+    未提供线程池时在取回时同步解码。
+    """
+
+    def __init__(self, executor=None, capacity=16, **decode_hint):
+        self.executor = executor
+        self.capacity = max(1, capacity)
+        self.decode_hint = decode_hint
+        self._pending = collections.deque()
+
+    def __len__(self):
+        return len(self._pending)
+
+    @property
+    def free(self):
+        """还可以提交的任务数"""
+        return max(0, self.capacity - len(self._pending))
+
+    def submit(self, page):
+        """提交一页：图片路径，或内存模式下的 (文件名, 原始字节)"""
+        img_path, source = page if isinstance(page, tuple) else (page, page)
+        if self.executor is None:
+            self._pending.append((img_path, source, None))
+        else:
+            future = self.executor.submit(load_page, source, **self.decode_hint)
+            self._pending.append((img_path, None, future))
+
+    def take(self, n):
+        """
+        按提交顺序取回最多 n 页的解码结果
+
+        Returns:
+            [(img_path, loaded, error)]，loaded 为 load_page 的返回值，解码失败时为 None 并附带异常
+        """
+        pages = []
+        while self._pending and len(pages) < n:
+            img_path, source, future = self._pending.popleft()
+            try:
+                if future is None:
+                    loaded = load_page(source, **self.decode_hint)
+                else:
+                    loaded = future.result()
+                pages.append((img_path, loaded, None))
+            except Exception as e:
+                pages.append((img_path, None, e))
+        return pages
+
+    def cancel(self):
+        """取消尚未开始的解码任务"""
+        while self._pending:
+            _, _, future = self._pending.popleft()
+            if future is not None:
+                future.cancel()
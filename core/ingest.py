@@ -0,0 +1,110 @@
+import asyncio
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from astrbot.api import logger
+
+# 卡片左侧封面区域尺寸（renderer.render_card 中 1000x500 卡片的左侧 40%）
+COVER_SIZE = (400, 500)
+
+
+class PageIngestor:
+    """
+    下载与分析之间的入库转码：每页只解码一次，缩小后重新编码为小 JPEG
+
+    模型只需要长边约 640 像素的输入，卡片只用到封面，保存原图既占磁盘又拖慢后续解码。
+    转码在独立线程池中进行，文件名保持不变（PIL 按内容识别格式）。封面保留到卡片所需分辨率。
+    写盘时页面先分块写入临时文件，再由线程池从临时文件转码（process_file），整页不在事件循环中缓冲。
+    """
+
+    def __init__(self, max_edge=640, workers=2, quality=90):
+        self.max_edge = max_edge
+        self.quality = quality
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="nh-ingest")
+        self._lock = threading.Lock()
+        self.pages = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _encode(self, source, cover):
+        """解码 source（字节流或文件对象）并缩小为 JPEG 字节；已经足够小的 JPEG 返回 None，表示保留原样"""
+        img = Image.open(source)
+        width, height = img.size
+        if cover:
+            # 填满封面区域所需的最小尺寸
+            scale = max(COVER_SIZE[0] / width, COVER_SIZE[1] / height)
+        else:
+            scale = self.max_edge / max(width, height)
+
+        if scale >= 1 and img.format == 'JPEG':
+            return None
+        scale = min(scale, 1.0)
+        target = (max(1, round(width * scale)), max(1, round(height * scale)))
+        if img.format == 'JPEG':
+            # 解码时直接按 1/2、1/4、1/8 缩小
+            img.draft('RGB', target)
+        img = img.convert('RGB')
+        if img.size != target:
+            img = img.resize(target, Image.Resampling.BILINEAR, reducing_gap=2.0)
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=self.quality)
+        return buffer.getvalue()
+
+    def _record(self, size_in, size_out):
+        with self._lock:
+            self.pages += 1
+            self.bytes_in += size_in
+            self.bytes_out += size_out
+
+    def transcode(self, data, cover=False):
+        """把一页原始字节转码为缩小后的 JPEG；已经足够小的 JPEG 原样返回，解码失败时返回原始字节"""
+        try:
+            output = self._encode(io.BytesIO(data), cover)
+        except Exception as e:
+            # 损坏的图片原样保留，由分析器按无效图片处理
+            logger.debug(f"入库转码失败，保留原图: {e}")
+            output = None
+        if output is None:
+            output = data
+
+        self._record(len(data), len(output))
+        return output
+
+    def transcode_file(self, src, dst, cover=False):
+        """把临时文件 src 中的一页转码后原子替换为 dst；无需转码或解码失败时直接改名"""
+        size_in = os.path.getsize(src)
+        try:
+            with open(src, 'rb') as f:
+                output = self._encode(f, cover)
+        except Exception as e:
+            logger.debug(f"入库转码失败，保留原图: {e}")
+            output = None
+
+        if output is not None:
+            # 原图已解码完毕，转码结果覆盖写回临时文件，半截文件不会出现在 dst
+            with open(src, 'wb') as f:
+                f.write(output)
+        os.replace(src, dst)
+        self._record(size_in, size_in if output is None else len(output))
+
+    async def process(self, data, cover=False):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.transcode, data, cover)
+
+    async def process_file(self, src, dst, cover=False):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self.transcode_file, src, dst, cover)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pages": self.pages,
+                "in_mb": round(self.bytes_in / 1024 / 1024, 1),
+                "out_mb": round(self.bytes_out / 1024 / 1024, 1),
+                "ratio": round(self.bytes_in / self.bytes_out, 2) if self.bytes_out else 0,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,4 +1,5 @@
 import os
+import queue
 import shutil
 import asyncio
 import threading
@@ -7,13 +8,25 @@ import uuid
 from PIL import Image as PILImage
 from astrbot.api import logger
 from .crawler import NHCrawler
-from .downloader import ImageDownloader
+from .downloader import ByteBudget, ImageDownloader
 from .analyzer import NSFWAnalyzer
+from .analysis_executor import AnalysisExecutor, AnalysisJob
 from .renderer import ResultRenderer
+from .sampler import AdaptiveSampler
+from .score_store import ScoreStore
+from .detections import DetectionStore, GalleryDetections, page_number
+from .memory_budget import MemoryBudget
+from .ingest import PageIngestor
+from .http_pool import HttpPool
+from .clearance import ClearanceStore
+from .concurrency import AIMDLimiter
+from .rate_limit import DEFAULT_HOST_RATE_LIMITS, HostRateLimiter
+from .mirrors import MirrorPool
 
 
 class DailyManager:
     DAILY_RESULT_CACHE_TTL = 15 * 60
+    DOWNLOAD_WORKERS = 3
     DAILY_SOURCE_LABELS = {
         "recent": "中文最新列表",
         "today": "今日中文热门",
@@ -30,19 +43,141 @@ class DailyManager:
             config.get("model_threshold", 0.08)
         )  # Default to 0.08 as per docs
         device = config.get("model_device", "")
+        model_backend = config.get("model_backend", "")
+        model_precision = config.get("model_precision", "fp32")
         self.min_pages = int(config.get("min_pages", 35))
         self.max_pages = int(config.get("max_pages", 300))
+        # 下载大小上限：单页与单个本子（按网络传输字节计），0 表示不限制
+        self.max_gallery_bytes = int(float(config.get("max_gallery_mb", 1024)) * 1024 * 1024)
+        batch_size = int(config.get("analyze_batch_size", 8))
+        self.analyze_concurrency = max(1, int(config.get("analyze_concurrency", 2)))
+        self.stream_analyze = bool(config.get("stream_analyze", True))
+        self.score_mode = config.get("score_mode", "full")
+        self.adaptive_ci_half_width = float(config.get("adaptive_ci_half_width", 0.08))
+        self.adaptive_min_samples = int(config.get("adaptive_min_samples", 16))
+        # 缩略图评分：按来源（recent / today / single）启用，只下载页面缩略图分类，模糊页再用原图复核
+        thumbnail_sources = config.get("thumbnail_sources", "")
+        if isinstance(thumbnail_sources, str):
+            thumbnail_sources = thumbnail_sources.split(",")
+        self.thumbnail_sources = {s.strip() for s in thumbnail_sources if s.strip()}
+        self.thumbnail_escalate_band = float(config.get("thumbnail_escalate_band", 0.1))
+        # 内存模式：页面不落盘，下载的原始字节经内存预算直接交给流式分析，只有封面写入磁盘
+        self.memory_budget = None
+        if config.get("in_memory_mode", False):
+            if self.stream_analyze:
+                self.memory_budget = MemoryBudget(
+                    int(config.get("memory_budget_mb", 256)) * 1024 * 1024
+                )
+            else:
+                logger.warning("内存模式需要开启流式分析，已忽略")
 
-        self.crawler = NHCrawler(proxy=proxy)
-        self.downloader = ImageDownloader(proxy=proxy)
+        # 按主机的令牌桶限速，爬虫与下载器共用，两者同时繁忙时也不会超出主机的速率
+        self.rate_limiter = HostRateLimiter(
+            config.get("host_rate_limits", DEFAULT_HOST_RATE_LIMITS)
+        )
+        # 入库转码：下载后立即缩小到模型所需尺寸，减少磁盘占用与分析时的解码开销
+        self.ingestor = None
+        if config.get("ingest_downscale", False):
+            self.ingestor = PageIngestor(max_edge=int(config.get("ingest_max_edge", 640)))
+        # 插件生命周期内共享的 HTTP 连接池，所有本子的下载与补救复用同一组长连接
+        self.http_pool = HttpPool(
+            limit_per_host=int(config.get("http_limit_per_host", 16)),
+            dns_ttl=int(config.get("http_dns_ttl", 300)),
+        )
+        base_dir = os.path.dirname(os.path.dirname(__file__))
+        # Cloudflare 会话（cookie 与 User-Agent）持久化到 data 目录，重启后不必重新求解质询
+        clearance_store = None
+        clearance_ttl_minutes = float(config.get("clearance_ttl_minutes", 30))
+        if clearance_ttl_minutes > 0:
+            clearance_store = ClearanceStore(
+                os.path.join(base_dir, "data", "cf_clearance.json"),
+                ttl_seconds=clearance_ttl_minutes * 60,
+            )
+        self.crawler = NHCrawler(
+            proxy=proxy,
+            rate_limiter=self.rate_limiter,
+            http_pool=self.http_pool,
+            async_fetch=bool(config.get("async_crawler", True)),
+            clearance_store=clearance_store,
+            metadata_source=config.get("metadata_source", "api"),
+        )
+        # 所有本子共享的自适应下载并发：请求健康时逐步提高，遇到 429/5xx/超时/延迟升高时减半
+        self.download_limiter = AIMDLimiter(
+            initial=int(config.get("download_concurrency", 8)),
+            max_limit=int(config.get("download_concurrency_max", 16)),
+        )
+        # 图片服务器镜像池：按延迟与失败率选择主机，失败的页面换主机重试；未配置时直接使用 i.nhentai.net
+        self.mirrors = None
+        image_hosts = config.get("image_hosts", "")
+        if image_hosts:
+            self.mirrors = MirrorPool(image_hosts)
+            logger.info(f"图片镜像池: {', '.join(self.mirrors.hosts)}")
+        self.downloader = ImageDownloader(
+            proxy=proxy,
+            ingestor=self.ingestor,
+            http_pool=self.http_pool,
+            limiter=self.download_limiter,
+            rate_limiter=self.rate_limiter,
+            max_page_bytes=int(float(config.get("max_page_mb", 20)) * 1024 * 1024),
+            mirrors=self.mirrors,
+        )
 
-        models_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "models")
-        self.analyzer = NSFWAnalyzer(models_dir, threshold=threshold, device=device)
+        models_dir = os.path.join(base_dir, "models")
+        self.analyzer = NSFWAnalyzer(
+            models_dir,
+            threshold=threshold,
+            device=device,
+            batch_size=batch_size,
+            dedup=bool(config.get("dedup_pages", True)),
+            near_dup_distance=int(config.get("near_dup_distance", 4)),
+            prefetch_workers=int(config.get("prefetch_workers", 2)),
+            prefetch_depth=int(config.get("prefetch_depth", 2)),
+            model_backend=model_backend,
+            model_precision=model_precision,
+            model_server_socket=config.get("model_server_socket", ""),
+            batch_wait_ms=int(config.get("batch_wait_ms", 20)),
+        )
         self.renderer = ResultRenderer()
+        # 分析任务专用的有界线程池：流式模式下每个下载中的本子各占一个线程
+        self.analysis_executor = AnalysisExecutor(
+            max_workers=max(self.analyze_concurrency, self.DOWNLOAD_WORKERS)
+        )
+
+        # 评分缓存放在 data 目录，不随启动时的 cache 清理而丢失
+        # 逐页原始检测结果不含阈值，调整阈值后可直接重算分数
+        self.score_store = None
+        self.detection_store = None
+        store_ttl_hours = float(config.get("score_store_ttl_hours", 72))
+        store_max_entries = int(config.get("score_store_max_entries", 5000))
+        if store_ttl_hours > 0:
+            self.score_store = ScoreStore(
+                os.path.join(base_dir, "data", "score_store.sqlite3"),
+                ttl_seconds=store_ttl_hours * 3600,
+                max_entries=store_max_entries,
+            )
+            self.detection_store = DetectionStore(
+                os.path.join(base_dir, "data", "detections"),
+                ttl_seconds=store_ttl_hours * 3600,
+                max_entries=store_max_entries,
+            )
 
         # 启动时清理插件缓存。
         self._cleanup_cache()
 
+        # 启动时在后台加载模型并预热，首个请求只需等待剩余部分
+        if config.get("model_warmup", True):
+            self.analyzer.start_warmup()
+
+    async def close(self):
+        """插件卸载时释放资源"""
+        if self.score_store:
+            self.score_store.close()
+        self.analyzer.close()
+        self.analysis_executor.shutdown()
+        if self.ingestor:
+            self.ingestor.shutdown()
+        await self.http_pool.close()
+
     def _cleanup_cache(self):
         try:
             base_dir = os.path.dirname(os.path.dirname(__file__))
@@ -169,6 +304,14 @@ class DailyManager:
                 missing_urls.append(url)
         return missing_urls
 
+    def _remove_gallery_dir(self, gallery_dir):
+        """删除本子的临时下载目录"""
+        if gallery_dir and os.path.exists(gallery_dir):
+            try:
+                shutil.rmtree(gallery_dir)
+            except Exception as e:
+                logger.warning(f"清理临时目录失败 {gallery_dir}: {e}")
+
     def _has_cover_image(self, gallery_dir):
         for ext in ["jpg", "png", "webp", "gif"]:
             cover_path = os.path.join(gallery_dir, f"1.{ext}")
@@ -176,13 +319,22 @@ class DailyManager:
                 return True
         return False
 
-    async def _rescue_cover_image(self, gid, image_urls, gallery_dir):
+    async def _download_cover(self, gid, image_urls, gallery_dir):
+        """单独下载封面（供抽样与缩略图模式生成卡片，不受下载预算限制）；下载失败时再走封面补救"""
+        if not image_urls or self._has_cover_image(gallery_dir):
+            return
+        await self.downloader.download_images(image_urls[:1], gallery_dir)
+        await self._rescue_cover_image(gid, image_urls, gallery_dir)
+
+    async def _rescue_cover_image(self, gid, image_urls, gallery_dir, on_page=None):
         if not image_urls or self._has_cover_image(gallery_dir):
             return False
 
         cover_url = image_urls[0]
         logger.warning(f"[下载] {gid} 封面图缺失，尝试重新打捞: {cover_url}")
-        await self.downloader.download_images([cover_url], gallery_dir)
+        await self.downloader.download_images(
+            [cover_url], gallery_dir, on_page=on_page
+        )
 
         if self._has_cover_image(gallery_dir):
             logger.info(f"[下载] {gid} 封面图重新打捞成功")
@@ -191,19 +343,53 @@ class DailyManager:
         logger.warning(f"[下载] {gid} 封面图重新打捞失败")
         return False
 
-    async def _rescue_missing_images(self, gid, image_urls, gallery_dir):
-        missing_urls = self._missing_image_urls(image_urls, gallery_dir)
+    async def _rescue_missing_images(
+        self,
+        gid,
+        image_urls,
+        gallery_dir,
+        on_page=None,
+        missing_urls=None,
+        memory=None,
+        budget=None,
+    ):
+        """重新下载缺失的页面，返回补回的页数
+
+        此时共享的并发控制器已按之前的失败降低了并发，无需单独的低并发下载器。
+
+        Args:
+            missing_urls: 可选，缺失的链接；内存模式下页面不落盘，需由调用方根据下载结果给出
+            memory: 可选，内存模式下本子的 MemoryLedger
+            budget: 可选，本子的 ByteBudget，已超出时不再补救
+        """
+        if missing_urls is None:
+            missing_urls = self._missing_image_urls(image_urls, gallery_dir)
         if not missing_urls:
             return 0
+        if budget is not None and budget.exceeded:
+            logger.warning(
+                f"[下载] {gid} 下载量已超过 {budget.limit_bytes // 1024 // 1024} MB 预算，"
+                f"跳过剩余 {len(missing_urls)} 张图片"
+            )
+            return 0
 
-        logger.warning(f"[下载] {gid} 缺失 {len(missing_urls)} 张图片，开始低并发补救")
-        await asyncio.sleep(3)
-        rescue_downloader = ImageDownloader(
-            max_concurrency=3, proxy=self.downloader.proxy
+        logger.warning(
+            f"[下载] {gid} 缺失 {len(missing_urls)} 张图片，开始补救 "
+            f"(当前并发上限 {self.download_limiter.current_limit})"
+        )
+        result = await self.downloader.download_images(
+            missing_urls,
+            gallery_dir,
+            on_page=on_page,
+            memory=memory,
+            persist=set(image_urls[:1]),
+            budget=budget,
         )
-        await rescue_downloader.download_images(missing_urls, gallery_dir)
 
-        remaining = self._missing_image_urls(image_urls, gallery_dir)
+        if memory is not None:
+            remaining = [item["url"] for item in result["failed"]]
+        else:
+            remaining = self._missing_image_urls(image_urls, gallery_dir)
         rescued_count = len(missing_urls) - len(remaining)
         logger.info(
             f"[下载] {gid} 缺页补救完成: 成功补回 {rescued_count}/{len(missing_urls)}"
@@ -212,6 +398,499 @@ class DailyManager:
             logger.warning(f"[下载] {gid} 仍缺失 {len(remaining)} 张图片")
         return rescued_count
 
+    def _new_byte_budget(self):
+        """为一个本子创建下载字节预算；未设置上限时返回 None"""
+        if self.max_gallery_bytes <= 0:
+            return None
+        return ByteBudget(self.max_gallery_bytes)
+
+    async def _download_gallery(self, gid, image_urls, gallery_dir, on_page=None, memory=None):
+        """下载本子全部图片（含封面与缺页补救），返回成功下载的页数
+
+        Args:
+            memory: 可选，MemoryLedger。传入时为内存模式，只有封面写入 gallery_dir
+        """
+        budget = self._new_byte_budget()
+        if memory is not None:
+            # 封面缺失时与其他缺页一起补救
+            result = await self.downloader.download_images(
+                image_urls,
+                gallery_dir,
+                on_page=on_page,
+                memory=memory,
+                persist=set(image_urls[:1]),
+                budget=budget,
+            )
+            missing_urls = [item["url"] for item in result["failed"]]
+            rescued = await self._rescue_missing_images(
+                gid,
+                image_urls,
+                gallery_dir,
+                on_page=on_page,
+                missing_urls=missing_urls,
+                memory=memory,
+                budget=budget,
+            )
+            return len(image_urls) - len(missing_urls) + rescued
+
+        await self.downloader.download_images(
+            image_urls, gallery_dir, on_page=on_page, budget=budget
+        )
+        # 封面用于生成卡片，不受下载预算限制
+        await self._rescue_cover_image(gid, image_urls, gallery_dir, on_page=on_page)
+        await self._rescue_missing_images(
+            gid, image_urls, gallery_dir, on_page=on_page, budget=budget
+        )
+        return self._downloaded_image_count(image_urls, gallery_dir)
+
+    async def _run_scoring(self, gid, scoring, stop_event, timeout):
+        """在截止时间内运行抽样/缩略图评分（评分过程包含下载）
+
+        超时时与流式分析一样设置 stop_event 并取消任务，正在运行的分类任务随之取消，然后抛出 asyncio.TimeoutError。
+
+        Returns:
+            已完成的评分任务，交给 _wait_analysis 取结果
+        """
+        analysis = asyncio.create_task(scoring)
+        done, _ = await asyncio.wait({analysis}, timeout=timeout)
+        if not done:
+            stop_event.set()
+            analysis.cancel()
+            await asyncio.gather(analysis, return_exceptions=True)
+            logger.warning(f"[分析] {gid} 评分超时（{timeout}秒），已中断")
+            raise asyncio.TimeoutError
+        return analysis
+
+    def _submit_folder_analysis(self, gallery, gallery_dir, stop_event):
+        """整本下载完成后提交文件夹分析"""
+        return self.analysis_executor.submit(
+            self.analyzer.analyze_folder,
+            gallery_dir,
+            stop_event,
+            gallery.get("detections"),
+            stop_event=stop_event,
+            name=gallery["id"],
+        )
+
+    async def _score_gallery(
+        self, gallery, image_urls, gallery_dir, score_mode, analyze_timeout, cutoff_fn=None
+    ):
+        """按评分模式下载本子并启动评分，每日排行与单本查询共用
+
+        抽样与缩略图模式下载与分类交替进行，在截止时间内完成；流式模式下每页下载完成即送入推理；
+        整本模式只负责下载，分析由调用方用 _submit_folder_analysis 提交。
+
+        Returns:
+            (analysis, stop_event, downloaded_count)：analysis 交给 _wait_analysis 取结果，整本模式下为 None
+
+        Raises:
+            asyncio.TimeoutError: 抽样/缩略图评分超时
+        """
+        gid = gallery["id"]
+        stop_event = threading.Event()
+        if score_mode in ("adaptive", "thumbnail"):
+            if score_mode == "thumbnail":
+                scoring = self._thumbnail_score(
+                    gid, image_urls, gallery_dir, stop_event, gallery.get("thumbnail_urls")
+                )
+            else:
+                scoring = self._adaptive_score(
+                    gid, image_urls, gallery_dir, stop_event, cutoff_fn=cutoff_fn
+                )
+            analysis = await self._run_scoring(gid, scoring, stop_event, analyze_timeout)
+            return analysis, stop_event, self._downloaded_image_count(image_urls, gallery_dir)
+
+        gallery["detections"] = GalleryDetections()
+        if not self.stream_analyze:
+            downloaded_count = await self._download_gallery(gid, image_urls, gallery_dir)
+            return None, stop_event, downloaded_count
+
+        memory = self.memory_budget.ledger() if self.memory_budget else None
+        on_page, finish, stop_event, analysis = self._start_stream_analysis(
+            gid, gallery["detections"], memory
+        )
+        try:
+            downloaded_count = await self._download_gallery(
+                gid, image_urls, gallery_dir, on_page=on_page, memory=memory
+            )
+        except BaseException:
+            stop_event.set()
+            raise
+        finally:
+            finish()
+        return analysis, stop_event, downloaded_count
+
+    async def _wait_analysis(self, analysis, timeout):
+        """等待分析结果；AnalysisJob 超时时会先取消并等待线程退出，再抛出 asyncio.TimeoutError"""
+        if isinstance(analysis, AnalysisJob):
+            return await analysis.result(timeout)
+        return await asyncio.wait_for(analysis, timeout=timeout)
+
+    def _start_stream_analysis(self, gid, detections=None, memory=None):
+        """启动流式分析线程。
+
+        Args:
+            memory: 可选，MemoryLedger。内存模式下页面以 (文件名, 原始字节) 送入分析，分析完即归还预算
+
+        Returns:
+            (on_page 回调, 结束函数, stop_event, 分析任务 AnalysisJob)。下载完所有页（含补救）后调用结束函数。
+        """
+        page_queue = queue.Queue()
+        stop_event = threading.Event()
+        task = self.analysis_executor.submit(
+            self.analyzer.analyze_stream,
+            page_queue,
+            stop_event,
+            detections,
+            memory.release if memory is not None else None,
+            stop_event=stop_event,
+            name=gid,
+        )
+        if memory is not None:
+            # 分析结束（含超时、中断）后归还该本子剩余的内存占用
+            task.future.add_done_callback(lambda _: memory.close())
+
+        def on_page(url, page):
+            if memory is not None:
+                page_queue.put((url.split("/")[-1], page))
+            else:
+                page_queue.put(page)
+
+        def finish():
+            page_queue.put(None)
+
+        return on_page, finish, stop_event, task
+
+    def _score_mode_for(self, source):
+        """来源对应的评分模式：thumbnail_sources 中的来源使用缩略图评分，其余按 score_mode"""
+        if source in self.thumbnail_sources:
+            return "thumbnail"
+        return self.score_mode
+
+    def _pipeline_fingerprint(self):
+        """
+        影响逐页结果的处理设置：近似页会直接沿用代表页的结果，去重设置不同结果也不同；
+        入库转码改变了模型实际看到的图片，长边与 JPEG 质量不同结果也不同
+        """
+        near_dup = self.analyzer.near_dup_distance if self.analyzer.dedup else "off"
+        ingest = f"{self.ingestor.max_edge}q{self.ingestor.quality}" if self.ingestor else "off"
+        return f"dedup={near_dup}:ingest={ingest}"
+
+    def _detection_fingerprint(self):
+        """原始检测结果的键：模型指纹 + 处理设置（不含阈值）；无可用模型时返回 None"""
+        model_fingerprint = self.analyzer.model_fingerprint()
+        if model_fingerprint is None:
+            return None
+        return f"{model_fingerprint}:{self._pipeline_fingerprint()}"
+
+    async def _score_fingerprint(self, score_mode):
+        """评分缓存指纹：模型文件哈希 + 阈值 + 处理设置 + 评分模式；无可用模型时返回 None"""
+        if not self.score_store:
+            return None
+        fingerprint = await asyncio.to_thread(self.analyzer.fingerprint)
+        if fingerprint is None:
+            return None
+        return f"{fingerprint}:{self._pipeline_fingerprint()}:{score_mode}"
+
+    async def _lookup_score(self, gallery, fingerprint, score_mode):
+        if not self.score_store or not fingerprint or not gallery.get("media_id"):
+            return None
+        try:
+            cached = await asyncio.to_thread(
+                self.score_store.get, gallery["id"], gallery["media_id"], fingerprint
+            )
+            if cached is None:
+                cached = await asyncio.to_thread(
+                    self._rescore_detections, gallery, score_mode
+                )
+                if cached is not None:
+                    await asyncio.to_thread(
+                        self.score_store.put,
+                        gallery["id"],
+                        gallery["media_id"],
+                        fingerprint,
+                        cached[0],
+                        cached[1],
+                    )
+            return cached
+        except Exception as e:
+            logger.warning(f"查询评分缓存失败 {gallery['id']}: {e}")
+            return None
+
+    def _rescore_detections(self, gallery, score_mode):
+        """用已保存的逐页原始结果按当前阈值重算评分（仅全量评分模式）"""
+        if not self.detection_store or score_mode != "full":
+            return None
+        model_fingerprint = self._detection_fingerprint()
+        if model_fingerprint is None:
+            return None
+        result = self.detection_store.rescore(
+            gallery["id"],
+            gallery["media_id"],
+            model_fingerprint,
+            self.analyzer.threshold,
+        )
+        if result:
+            logger.debug(f"[缓存命中] {gallery['id']} 由原始检测结果按当前阈值重算")
+        return result
+
+    def _save_detections(self, gallery, detections):
+        model_fingerprint = self._detection_fingerprint()
+        if model_fingerprint is None:
+            return
+        self.detection_store.save(
+            gallery["id"],
+            gallery["media_id"],
+            model_fingerprint,
+            self.analyzer.verdict_policy,
+            self.analyzer.label_names,
+            detections,
+        )
+
+    async def _save_score(self, gallery, fingerprint):
+        stats = gallery.get("stats")
+        detections = gallery.pop("detections", None)
+        if not self.score_store or not fingerprint or not gallery.get("media_id"):
+            return
+        # 中断、无模型或无图片的结果不缓存
+        if not stats or "error" in stats:
+            return
+        # 有页面没能下载或分析的结果不缓存，避免临时的网络问题让错误分数在缓存有效期内一直沿用
+        missing = stats.get("missing")
+        if missing is None:
+            # 整本分析：分析到的页数少于本子页数即为不完整
+            missing = max(0, int(gallery.get("page_count") or 0) - stats.get("total", 0))
+        if missing:
+            logger.info(f"[缓存] {gallery['id']} 有 {missing} 页未能分析，不写入评分缓存")
+            return
+        try:
+            await asyncio.to_thread(
+                self.score_store.put,
+                gallery["id"],
+                gallery["media_id"],
+                fingerprint,
+                gallery.get("score", 0),
+                stats,
+            )
+            if detections is not None and self.detection_store:
+                await asyncio.to_thread(self._save_detections, gallery, detections)
+        except Exception as e:
+            logger.warning(f"写入评分缓存失败 {gallery['id']}: {e}")
+
+    async def _fetch_cover(self, gallery, cache_dir):
+        """为命中评分缓存（未下载图片）的本子单独下载封面"""
+        cover_url = gallery.get("cover_url")
+        if not cover_url or gallery.get("local_cover"):
+            return
+
+        gid = gallery["id"]
+        cover_dir = os.path.join(cache_dir, f"cover_{gid}")
+        try:
+            await self.downloader.download_images([cover_url], cover_dir)
+            filename = cover_url.split("/")[-1]
+            cover_path = os.path.join(cover_dir, filename)
+            if os.path.exists(cover_path) and os.path.getsize(cover_path) > 0:
+                ext = os.path.splitext(filename)[1]
+                saved_cover = os.path.join(cache_dir, f"cover_{gid}{ext}")
+                shutil.move(cover_path, saved_cover)
+                gallery["local_cover"] = saved_cover
+            else:
+                logger.warning(f"[缓存命中] {gid} 封面下载失败")
+        except Exception as e:
+            logger.warning(f"[缓存命中] {gid} 封面下载出错: {e}")
+        finally:
+            shutil.rmtree(cover_dir, ignore_errors=True)
+
+    def _top_cutoff(self, analyzed_galleries, top_n=10):
+        """返回当前前 top_n 名的最低分；已分析数量不足时返回 None"""
+        if len(analyzed_galleries) < top_n:
+            return None
+        scores = sorted((g.get("score", 0) for g in analyzed_galleries), reverse=True)
+        return scores[top_n - 1]
+
+    async def _adaptive_score(
+        self, gid, image_urls, gallery_dir, stop_event, cutoff_fn=None
+    ):
+        """自适应抽样评分。
+
+        按分层随机顺序分批下载并分类页面，估计足够准确、或明显进不了前 10 时提前停止。
+
+        Args:
+            cutoff_fn: 可选，返回当前前 10 名最低 CB 指数的函数
+
+        Returns:
+            与 analyze_folder 相同的 (score, stats)，stats 额外包含抽样页数与置信区间
+        """
+        if not await asyncio.to_thread(self.analyzer.ensure_model):
+            return 0, {"error": "No model loaded"}
+
+        sampler = AdaptiveSampler(
+            len(image_urls),
+            ci_half_width=self.adaptive_ci_half_width,
+            min_samples=self.adaptive_min_samples,
+        )
+        order = sampler.order()
+        deduper = self.analyzer.new_deduper()
+        budget = self._new_byte_budget()
+        step = max(self.analyzer.batch_size, self.download_limiter.current_limit)
+        stop_reason = None
+        missing = 0
+
+        for start in range(0, len(order), step):
+            if stop_event.is_set():
+                logger.warning(f"[抽样] {gid} 分析任务中断")
+                return 0, {"error": "Interrupted"}
+
+            urls = [image_urls[i] for i in order[start : start + step]]
+            result = await self.downloader.download_images(urls, gallery_dir, budget=budget)
+            failed_urls = {item["url"] for item in result["failed"]}
+            missing += len(failed_urls)
+            page_paths = [
+                os.path.join(gallery_dir, url.split("/")[-1])
+                for url in urls
+                if url not in failed_urls
+            ]
+
+            hentai = await self.analysis_executor.run(
+                self.analyzer.count_hentai_pages,
+                page_paths,
+                stop_event,
+                None,
+                deduper,
+                stop_event=stop_event,
+                name=gid,
+            )
+            if hentai is None:
+                return 0, {"error": "Interrupted"}
+
+            sampler.record(len(page_paths), hentai)
+            stop_reason = sampler.stop_reason(cutoff_fn() if cutoff_fn else None)
+            if stop_reason:
+                break
+
+        # 抽样不一定抽到第 1 页，封面单独下载
+        await self._download_cover(gid, image_urls, gallery_dir)
+
+        score, stats = sampler.result(stop_reason)
+        if stats:
+            # 抽到但未能下载的页数，用于判断结果是否可以缓存
+            stats["missing"] = missing
+        if stats and deduper:
+            stats.update(deduper.stats())
+        if stats:
+            low, high = stats["ci"]
+            logger.info(
+                f"[抽样] {gid} 抽样 {stats['sampled']}/{len(image_urls)} 页 ({stop_reason or 'done'})，"
+                f"估计 CB指数 {score:.1f}% [{low:.1f}%, {high:.1f}%]"
+            )
+        return score, stats
+
+    async def _thumbnail_score(self, gid, image_urls, gallery_dir, stop_event, thumbnail_urls=None):
+        """缩略图评分。
+
+        先下载 t.nhentai.net 的页面缩略图并分类，流量约为原图的十分之一；缩略图缺失或结果落在
+        判定边界附近（±thumbnail_escalate_band）的页面再下载原图复核。封面仍使用原图。
+
+        Args:
+            thumbnail_urls: 爬虫从详情页或 API 取得的各页缩略图链接；缺失的页由原图链接推算
+
+        Returns:
+            与 analyze_folder 相同的 (score, stats)，stats 额外包含 thumbnail 标记与复核页数 escalated
+        """
+        if not await asyncio.to_thread(self.analyzer.ensure_model):
+            return 0, {"error": "No model loaded"}
+
+        # 缩略图文件名为 {page}t{ext}（可能带二次扩展名，如 12t.jpg.webp），与原图共用目录不会冲突，页码解析结果相同
+        if not thumbnail_urls or len(thumbnail_urls) != len(image_urls):
+            thumbnail_urls = [None] * len(image_urls)
+        thumb_urls = [
+            thumb or self.crawler.thumbnail_url(url)
+            for url, thumb in zip(image_urls, thumbnail_urls)
+        ]
+        budget = self._new_byte_budget()
+        result = await self.downloader.download_images(thumb_urls, gallery_dir, budget=budget)
+        failed_urls = {item["url"] for item in result["failed"]}
+        thumb_paths = [
+            os.path.join(gallery_dir, url.split("/")[-1])
+            for url in thumb_urls
+            if url not in failed_urls
+        ]
+
+        thumb_detections = GalleryDetections()
+        hentai = await self.analysis_executor.run(
+            self.analyzer.count_hentai_pages,
+            thumb_paths,
+            stop_event,
+            thumb_detections,
+            self.analyzer.new_deduper(),
+            stop_event=stop_event,
+            name=gid,
+        )
+        if hentai is None:
+            return 0, {"error": "Interrupted"}
+
+        # 缩略图下载失败的页面；复核时原图下载成功才算补上
+        thumb_failed = {page_number(url) for url in failed_urls}
+        missing = len(thumb_failed)
+        escalate = [
+            page_no
+            for page_no in range(1, len(image_urls) + 1)
+            if self.analyzer.is_ambiguous(
+                thumb_detections.get(page_no), self.thumbnail_escalate_band
+            )
+        ]
+        if escalate:
+            if stop_event.is_set():
+                logger.warning(f"[缩略图] {gid} 分析任务中断")
+                return 0, {"error": "Interrupted"}
+
+            urls = [image_urls[page_no - 1] for page_no in escalate]
+            result = await self.downloader.download_images(urls, gallery_dir, budget=budget)
+            failed_urls = {item["url"] for item in result["failed"]}
+            page_paths = [
+                os.path.join(gallery_dir, url.split("/")[-1])
+                for url in urls
+                if url not in failed_urls
+            ]
+
+            # 原图与缩略图的感知哈希相同，复核时不能共用缩略图阶段的去重器
+            full_hentai = await self.analysis_executor.run(
+                self.analyzer.count_hentai_pages,
+                page_paths,
+                stop_event,
+                None,
+                self.analyzer.new_deduper(),
+                stop_event=stop_event,
+                name=gid,
+            )
+            if full_hentai is None:
+                return 0, {"error": "Interrupted"}
+
+            missing = len(thumb_failed - {page_number(path) for path in page_paths})
+
+            # 已复核的页面以原图结果替换缩略图结果；原图下载失败的页面保留缩略图结果
+            for path in page_paths:
+                if self.analyzer.is_nsfw(thumb_detections.get(page_number(path))):
+                    hentai -= 1
+            hentai += full_hentai
+
+        await self._download_cover(gid, image_urls, gallery_dir)
+
+        total_pages = len(image_urls)
+        score = (hentai / total_pages) * 100
+        stats = {
+            "total": total_pages,
+            "hentai": hentai,
+            "thumbnail": True,
+            "escalated": len(escalate),
+            "missing": missing,
+        }
+        logger.info(
+            f"[缩略图] {gid} 缩略图 {len(thumb_paths)}/{total_pages} 页，原图复核 {len(escalate)} 页，"
+            f"CB指数 {score:.1f}%"
+        )
+        return score, stats
+
     async def process_daily_ranking(
         self, source="recent", total_timeout=1200, analyze_timeout=300
     ):
@@ -274,6 +953,8 @@ class DailyManager:
             os.makedirs(cache_dir)
 
         logger.info(f"获取到 {len(galleries)} 个本子，开始并行处理...")
+        score_mode = self._score_mode_for(source)
+        fingerprint = await self._score_fingerprint(score_mode)
 
         # 队列
         download_queue = asyncio.Queue()
@@ -346,13 +1027,28 @@ class DailyManager:
                     if metadata:
                         gallery.update(metadata)
 
-                    # 下载图片
-                    await self.downloader.download_images(image_urls, gallery_dir)
-                    await self._rescue_cover_image(gid, image_urls, gallery_dir)
-                    await self._rescue_missing_images(gid, image_urls, gallery_dir)
-                    downloaded_count = self._downloaded_image_count(
-                        image_urls, gallery_dir
+                    # 评分缓存命中时跳过下载与分析，封面在生成卡片前再单独下载
+                    cached = await self._lookup_score(gallery, fingerprint, score_mode)
+                    if cached:
+                        gallery["score"], gallery["stats"] = cached
+                        gallery["cover_url"] = image_urls[0]
+                        analyzed_galleries.append(gallery)
+                        logger.info(
+                            f"[缓存命中] ID:{gid} 得分:{gallery['score']:.2f}，跳过下载与分析"
+                        )
+                        continue
+
+                    # 下载图片；抽样与缩略图评分包含下载，在下载 Worker 内等待以保持下载并发上限
+                    analysis, stop_event, downloaded_count = await self._score_gallery(
+                        gallery,
+                        image_urls,
+                        gallery_dir,
+                        score_mode,
+                        analyze_timeout,
+                        cutoff_fn=lambda: self._top_cutoff(analyzed_galleries),
                     )
+                    gallery["analysis"] = analysis
+                    gallery["stop_event"] = stop_event
 
                     # 放入分析队列
                     gallery["gallery_dir"] = gallery_dir
@@ -364,9 +1060,15 @@ class DailyManager:
                 except asyncio.TimeoutError:
                     logger.warning(f"[下载] 处理 {gid} 超时")
                     failed_galleries.append(gid)
+                    self._remove_gallery_dir(gallery_dir)
                 except Exception as e:
                     logger.error(f"[下载] 处理 {gid} 出错: {e}")
                     failed_galleries.append(gid)
+                    self._remove_gallery_dir(gallery_dir)
+                except BaseException:
+                    # 任务被取消（如整体超时）时同样清理已下载的页面
+                    self._remove_gallery_dir(gallery_dir)
+                    raise
                 finally:
                     download_queue.task_done()
 
@@ -384,18 +1086,21 @@ class DailyManager:
                     f"[分析] 正在分析: {gid} - {gallery.get('title', 'Unknown')[:30]}..."
                 )
 
-                stop_event = threading.Event()
+                # 流式模式下分析任务已在下载阶段启动
+                analysis = gallery.pop("analysis", None)
+                stop_event = gallery.pop("stop_event", None) or threading.Event()
                 try:
-                    # 分析（带超时控制，传入stop_event）
-                    score, nsfw_stats = await asyncio.wait_for(
-                        asyncio.to_thread(
-                            self.analyzer.analyze_folder, gallery_dir, stop_event
-                        ),
-                        timeout=analyze_timeout,
+                    if analysis is None:
+                        analysis = self._submit_folder_analysis(gallery, gallery_dir, stop_event)
+
+                    # 分析（带超时控制；超时后发出停止信号并等待线程在宽限期内退出）
+                    score, nsfw_stats = await self._wait_analysis(
+                        analysis, analyze_timeout
                     )
 
                     gallery["score"] = score
                     gallery["stats"] = nsfw_stats
+                    await self._save_score(gallery, fingerprint)
 
                     # 提取封面 (支持多种格式)
                     cover_found = False
@@ -431,27 +1136,31 @@ class DailyManager:
                     )
 
                 except asyncio.TimeoutError:
-                    logger.warning(f"[分析] 分析 {gid} 超时（{analyze_timeout}秒）")
                     stop_event.set()  # 触发停止信号
+                    logger.warning(
+                        f"[分析] 分析 {gid} 超时（{analyze_timeout}秒），"
+                        f"分析任务 {self.analysis_executor.stats()}"
+                    )
                     failed_galleries.append(gid)
                 except Exception as e:
                     logger.error(f"[分析] 出错 {gid}: {e}")
                     failed_galleries.append(gid)
                 finally:
                     # 清理
-                    if gallery_dir and os.path.exists(gallery_dir):
-                        try:
-                            shutil.rmtree(gallery_dir)
-                        except Exception as e:
-                            logger.warning(f"清理临时目录失败 {gallery_dir}: {e}")
+                    self._remove_gallery_dir(gallery_dir)
                     analyze_queue.task_done()
 
         # 启动 Workers
         # 下载 Worker 数量可以多一点 (IO密集)
-        download_workers = [asyncio.create_task(download_worker()) for _ in range(3)]
+        download_workers = [
+            asyncio.create_task(download_worker()) for _ in range(self.DOWNLOAD_WORKERS)
+        ]
 
         # 分析 Worker 数量少一点 (CPU/GPU密集)，甚至1个，避免显存爆炸
-        analyze_workers = [asyncio.create_task(analyze_worker()) for _ in range(1)]
+        # 多个本子同时分析时，页面由分析器的推理调度线程拼成共享批次，模型仍只有一份
+        analyze_workers = [
+            asyncio.create_task(analyze_worker()) for _ in range(self.analyze_concurrency)
+        ]
 
         # 等待所有下载完成
         await download_queue.join()
@@ -470,6 +1179,23 @@ class DailyManager:
         logger.info(
             f"处理完成: 成功 {len(analyzed_galleries)} 个, 跳过 {len(skipped_galleries)} 个, 失败 {len(failed_galleries)} 个"
         )
+        logger.info(f"分析任务: {self.analysis_executor.stats()}")
+        if self.memory_budget:
+            logger.info(f"内存预算: {self.memory_budget.stats()}")
+        if self.ingestor:
+            logger.info(f"入库转码: {self.ingestor.stats()}")
+        logger.info(f"HTTP 连接池: {self.http_pool.stats()}")
+        logger.info(f"下载并发: {self.download_limiter.stats()}")
+        logger.info(f"主机限速: {self.rate_limiter.stats()}")
+        logger.info(f"页面抓取: {self.crawler.stats()}")
+        if self.mirrors:
+            logger.info(f"图片镜像: {self.mirrors.stats()}")
+        scheduler_stats = self.analyzer.scheduler_stats()
+        if scheduler_stats:
+            logger.info(
+                f"推理调度累计 {scheduler_stats['batches']} 批，共 {scheduler_stats['pages']} 页，"
+                f"平均每批 {scheduler_stats['avg_batch']} 页"
+            )
 
         if not analyzed_galleries:
             logger.warning("没有成功分析任何本子")
@@ -479,6 +1205,8 @@ class DailyManager:
         logger.info("生成结果卡片...")
         analyzed_galleries.sort(key=lambda x: x.get("score", 0), reverse=True)
         top_n = analyzed_galleries[:10]  # 保留前10个
+        for g in top_n:
+            await self._fetch_cover(g, cache_dir)
 
         # 检查是否有结果可生成卡片。
         if len(top_n) == 0:
@@ -498,8 +1226,13 @@ class DailyManager:
 
         return final_card
 
-    async def process_single_gallery(self, gid):
-        """处理单个本子"""
+    async def process_single_gallery(self, gid, analyze_timeout=300):
+        """处理单个本子
+
+        Args:
+            gid: 本子 ID
+            analyze_timeout: 分析超时时间（秒），默认5分钟
+        """
         logger.info(f"开始处理单个本子: {gid}")
 
         base_dir = os.path.dirname(os.path.dirname(__file__))
@@ -537,25 +1270,52 @@ class DailyManager:
                 "title": metadata.get("title", f"Gallery {gid}"),
                 "page_count": metadata.get("page_count", len(image_urls)),
                 "tags": metadata.get("tags", []),
+                "media_id": metadata.get("media_id"),
+                "thumbnail_urls": metadata.get("thumbnail_urls"),
                 "gallery_dir": gallery_dir,
             }
 
-            # 2. 下载图片
-            await self.downloader.download_images(image_urls, gallery_dir)
-            await self._rescue_cover_image(gid, image_urls, gallery_dir)
-            await self._rescue_missing_images(gid, image_urls, gallery_dir)
-            downloaded_count = self._downloaded_image_count(image_urls, gallery_dir)
+            score_mode = self._score_mode_for("single")
+            fingerprint = await self._score_fingerprint(score_mode)
+            cached = await self._lookup_score(gallery, fingerprint, score_mode)
+            if cached:
+                gallery["score"], gallery["stats"] = cached
+                gallery["cover_url"] = image_urls[0]
+                logger.info(f"[缓存命中] {gid} 得分:{gallery['score']:.2f}，跳过下载与分析")
+                await self._fetch_cover(gallery, cache_dir)
+                output_path = os.path.join(cache_dir, f"nh_{gid}.jpg")
+                final_card = self.renderer.render_card([gallery], output_path)
+                if gallery.get("local_cover"):
+                    try:
+                        os.remove(gallery["local_cover"])
+                    except:
+                        pass
+                return final_card
+
+            # 2. 下载图片（抽样模式下只下载抽到的页，缩略图模式下只下载缩略图与需复核的原图，
+            #    流式模式下边下载边分析）
+            try:
+                analysis, stop_event, downloaded_count = await self._score_gallery(
+                    gallery, image_urls, gallery_dir, score_mode, analyze_timeout
+                )
+            except asyncio.TimeoutError:
+                return None
+            if analysis is None:
+                analysis = self._submit_folder_analysis(gallery, gallery_dir, stop_event)
             logger.info(
-                f"[下载完成] {gid} ({downloaded_count}/{len(image_urls)}) - 开始分析"
+                f"[下载完成] {gid} ({downloaded_count}/{len(image_urls)}) - 等待分析结果"
             )
 
             # 3. 分析
-            stop_event = threading.Event()
-            score, nsfw_stats = await asyncio.to_thread(
-                self.analyzer.analyze_folder, gallery_dir, stop_event
-            )
+            try:
+                score, nsfw_stats = await self._wait_analysis(analysis, analyze_timeout)
+            except asyncio.TimeoutError:
+                stop_event.set()
+                logger.warning(f"分析 {gid} 超时（{analyze_timeout}秒）")
+                return None
             gallery["score"] = score
             gallery["stats"] = nsfw_stats
+            await self._save_score(gallery, fingerprint)
 
             # 4. 提取封面
             cover_found = False
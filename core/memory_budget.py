@@ -0,0 +1,99 @@
+import asyncio
+import threading
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class MemoryBudget:
+    """内存模式下“已下载、未分析”页面的内存预算（跨本子共享）。
+
+    下载协程在事件循环中 acquire，分析线程处理完页面后 release。预算用满时 acquire 会等待，
+    此时下载并发槽位不会释放，从而对下载形成背压。
+    """
+
+    def __init__(self, limit_bytes):
+        self.limit_bytes = limit_bytes
+        self._lock = threading.Lock()
+        self._used = 0
+        self._waiters = []  # [(loop, future)]
+        self.peak = 0
+        self.waits = 0
+
+    @property
+    def used(self):
+        return self._used
+
+    async def acquire(self, size):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                # 预算为空时总是放行，单页超过预算也不会永远等待
+                if self._used == 0 or self._used + size <= self.limit_bytes:
+                    self._used += size
+                    self.peak = max(self.peak, self._used)
+                    return
+                future = loop.create_future()
+                self._waiters.append((loop, future))
+                self.waits += 1
+            await future
+
+    def release(self, size):
+        """可在任意线程调用"""
+        with self._lock:
+            self._used = max(0, self._used - size)
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+    def ledger(self):
+        return MemoryLedger(self)
+
+    def stats(self):
+        return {
+            "limit_mb": round(self.limit_bytes / 1024 / 1024, 1),
+            "used_mb": round(self._used / 1024 / 1024, 1),
+            "peak_mb": round(self.peak / 1024 / 1024, 1),
+            "waits": self.waits,
+        }
+
+
+class MemoryLedger:
+    """单个本子在 MemoryBudget 中的账目：按文件名记录占用，本子结束时归还剩余部分"""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self._lock = threading.Lock()
+        self._sizes = {}
+        self._closed = False
+
+    async def acquire(self, name, size):
+        if self._closed:
+            return
+        await self.budget.acquire(size)
+        with self._lock:
+            if self._closed:
+                release = size
+            else:
+                release = self._sizes.pop(name, 0)
+                self._sizes[name] = size
+        if release:
+            self.budget.release(release)
+
+    def release(self, name):
+        """页面已分析完毕，归还其占用"""
+        with self._lock:
+            size = self._sizes.pop(name, 0)
+        if size:
+            self.budget.release(size)
+
+    def close(self):
+        """本子结束（完成、超时或中断），归还全部剩余占用"""
+        with self._lock:
+            self._closed = True
+            size = sum(self._sizes.values())
+            self._sizes.clear()
+        if size:
+            self.budget.release(size)
@@ -0,0 +1,137 @@
+import time
+from urllib.parse import urlparse, urlunparse
+from astrbot.api import logger
+
+# 爬虫构造的原图链接所用的主机，镜像池只改写这些主机的链接
+CANONICAL_IMAGE_HOSTS = ("i.nhentai.net",)
+
+
+def parse_hosts(text):
+    """解析逗号分隔的主机列表，未写协议的按 https 处理，返回 [scheme://netloc]"""
+    hosts = []
+    for item in str(text or "").split(","):
+        item = item.strip().rstrip("/")
+        if not item:
+            continue
+        if "://" not in item:
+            item = f"https://{item}"
+        parsed = urlparse(item)
+        if parsed.netloc:
+            hosts.append(f"{parsed.scheme}://{parsed.netloc}")
+    return hosts
+
+
+class _HostState:
+    def __init__(self):
+        self.latency = None  # 首字节延迟的 EWMA（秒）
+        self.error_rate = 0.0  # 失败率的 EWMA
+        self.updated = time.monotonic()
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.misses = 0  # 404 次数
+
+
+class MirrorPool:
+    """
+    图片服务器镜像池
+
+    按滚动的首字节延迟与失败率给每个主机打分，每个页面请求发往当前最健康的主机；失败后换一个没试过的主机重试。
+    失败率随时间衰减，被冷落的主机过一段时间会重新得到尝试；从未请求过的主机优先尝试一次。
+    主机可以是任意 scheme://host[:port]，便于用本地 HTTP 服务替身测试。
+    """
+
+    # 失败率的半衰期（秒）
+    ERROR_HALF_LIFE = 60.0
+    # 失败率对得分的惩罚倍数
+    ERROR_PENALTY = 10.0
+    # 只失败过、还没有成功延迟样本的主机按此延迟（秒）计分
+    DEFAULT_LATENCY = 2.0
+    # 404 计入失败率的权重：镜像可能只是尚未同步个别页面，比连接失败、5xx 轻
+    MISS_WEIGHT = 0.5
+
+    def __init__(self, hosts, canonical_hosts=CANONICAL_IMAGE_HOSTS, alpha=0.2):
+        if isinstance(hosts, str):
+            hosts = parse_hosts(hosts)
+        self.hosts = list(dict.fromkeys(hosts))
+        self.alpha = alpha
+        self._states = {host: _HostState() for host in self.hosts}
+        self._canonical = {h.lower() for h in canonical_hosts}
+        self._canonical.update(urlparse(host).netloc.lower() for host in self.hosts)
+
+    def applies(self, url):
+        """该链接是否由镜像池分配主机"""
+        return bool(self.hosts) and urlparse(url).netloc.lower() in self._canonical
+
+    def rewrite(self, url, host):
+        """把链接的协议与主机替换为 host，路径不变"""
+        target = urlparse(host)
+        return urlunparse(urlparse(url)._replace(scheme=target.scheme, netloc=target.netloc))
+
+    def _error_rate(self, state, now):
+        return state.error_rate * 0.5 ** ((now - state.updated) / self.ERROR_HALF_LIFE)
+
+    def _score(self, state, now):
+        """得分越低越健康：延迟 × 当前负载 × 失败惩罚"""
+        latency = state.latency
+        if latency is None:
+            if state.failures == 0 and state.misses == 0:
+                # 尚未探测过的主机优先，按在途请求数分散到各个主机
+                return state.in_flight * 1e-3
+            latency = self.DEFAULT_LATENCY
+        return (
+            latency
+            * (1 + state.in_flight)
+            * (1 + self.ERROR_PENALTY * self._error_rate(state, now))
+        )
+
+    def choose(self, exclude=()):
+        """选出当前最健康的主机；exclude 中的主机已全部试过时仍从全部主机中选"""
+        candidates = [host for host in self.hosts if host not in exclude] or self.hosts
+        now = time.monotonic()
+        return min(candidates, key=lambda host: self._score(self._states[host], now))
+
+    def has_untried(self, tried):
+        return any(host not in tried for host in self.hosts)
+
+    def begin(self, host):
+        state = self._states[host]
+        state.in_flight += 1
+        state.requests += 1
+
+    def end(self, host, ok, latency=None, miss=False):
+        """记录一次请求结果；miss 表示该主机没有这一页（404），按 MISS_WEIGHT 计入失败率；
+        ok 为 None 且不是 miss 时表示与主机健康无关（如取回后处理出错）"""
+        state = self._states[host]
+        state.in_flight = max(0, state.in_flight - 1)
+        now = time.monotonic()
+        if miss:
+            state.misses += 1
+            error = self.MISS_WEIGHT
+        elif ok is None:
+            return
+        else:
+            error = 0.0 if ok else 1.0
+        state.error_rate = (1 - self.alpha) * self._error_rate(state, now) + self.alpha * error
+        state.updated = now
+        if ok and latency is not None:
+            if state.latency is None:
+                state.latency = latency
+            else:
+                state.latency = (1 - self.alpha) * state.latency + self.alpha * latency
+        elif ok is False:
+            state.failures += 1
+            logger.debug(f"镜像 {host} 请求失败，当前失败率 {state.error_rate:.2f}")
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            urlparse(host).netloc: {
+                "requests": state.requests,
+                "failures": state.failures,
+                "misses": state.misses,
+                "latency_ms": round(state.latency * 1000) if state.latency is not None else None,
+                "error_rate": round(self._error_rate(state, now), 2),
+            }
+            for host, state in self._states.items()
+        }
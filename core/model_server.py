@@ -0,0 +1,172 @@
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+import numpy as np
+from PIL import Image
+from astrbot.api import logger
+
+# 每条消息: 8 字节头 (JSON 长度, 负载长度，大端) + JSON + 负载
+_FRAME = struct.Struct('>II')
+
+
+class ModelServerError(Exception):
+    """模型服务返回的错误（连接本身正常）"""
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1024 * 1024))
+        if not chunk:
+            raise ConnectionError("模型服务连接已断开")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def send_message(sock, header, payload=b''):
+    data = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    sock.sendall(_FRAME.pack(len(data), len(payload)) + data)
+    if payload:
+        sock.sendall(payload)
+
+
+def recv_message(sock):
+    header_size, payload_size = _FRAME.unpack(_recv_exact(sock, _FRAME.size))
+    header = json.loads(_recv_exact(sock, header_size).decode('utf-8'))
+    payload = _recv_exact(sock, payload_size) if payload_size else b''
+    return header, payload
+
+
+def encode_images(images):
+    """把已解码、已缩小的 RGB 图片打包为原始像素，服务端无需再次解码"""
+    shapes = []
+    buffers = []
+    for img in images:
+        shapes.append([img.width, img.height])
+        buffers.append(np.asarray(img, dtype=np.uint8).tobytes())
+    return shapes, b''.join(buffers)
+
+
+def decode_images(shapes, payload):
+    images = []
+    offset = 0
+    for width, height in shapes:
+        size = width * height * 3
+        images.append(Image.frombytes('RGB', (width, height), payload[offset:offset + size]))
+        offset += size
+    return images
+
+
+class ModelClient:
+    """模型服务的客户端，一条长连接，按请求串行收发"""
+
+    def __init__(self, socket_path, timeout=120):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock = None
+
+    def _call(self, header, payload=b''):
+        with self._lock:
+            # 连接断开后重连一次，服务重启后无需重启插件
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                        sock.settimeout(self.timeout)
+                        sock.connect(self.socket_path)
+                        self._sock = sock
+                    send_message(self._sock, header, payload)
+                    response, _ = recv_message(self._sock)
+                    break
+                except OSError:
+                    self._close_socket()
+                    if attempt:
+                        raise
+
+        if "error" in response:
+            raise ModelServerError(response["error"])
+        return response
+
+    def info(self):
+        """返回服务端模型信息: model_type / model_hash / backend / precision / verdict_policy / label_names / decode_hint"""
+        info = self._call({"op": "info"})
+        info["label_names"] = {int(k): v for k, v in info["label_names"].items()}
+        return info
+
+    def infer(self, images):
+        """推理一批图片，返回逐页原始结果 [(class_id, conf), ...]，失败的图片为 None"""
+        shapes, payload = encode_images(images)
+        response = self._call({"op": "infer", "shapes": shapes}, payload)
+        return [
+            None if record is None else [(int(c), float(p)) for c, p in record]
+            for record in response["records"]
+        ]
+
+    def _close_socket(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+    def close(self):
+        with self._lock:
+            self._close_socket()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        analyzer = self.server.analyzer
+        while True:
+            try:
+                header, payload = recv_message(self.connection)
+            except (ConnectionError, OSError, struct.error):
+                return
+
+            try:
+                op = header.get("op")
+                if op == "info":
+                    response = {
+                        "model_type": analyzer.model_type,
+                        "model_hash": analyzer.model_fingerprint().split(":", 1)[1],
+                        "backend": analyzer.backend,
+                        "precision": analyzer.precision,
+                        "verdict_policy": analyzer.verdict_policy,
+                        "label_names": {str(k): v for k, v in analyzer.label_names.items()},
+                        "decode_hint": analyzer.decode_hint,
+                    }
+                elif op == "infer":
+                    images = decode_images(header["shapes"], payload)
+                    # 多个客户端的请求按推理锁串行；启用拼批时会合并成同一批
+                    records = analyzer.classify_images(images)
+                    response = {"records": records}
+                else:
+                    response = {"error": f"未知操作: {op}"}
+            except Exception as e:
+                logger.warning(f"处理模型服务请求出错: {e}")
+                response = {"error": str(e)}
+
+            send_message(self.connection, response)
+
+
+class ModelServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    本机共享的模型服务
+
+    独立进程持有一份模型，多个 AstrBot 实例通过 Unix socket 发送已解码的页面并取回逐页原始结果，
+    阈值判定仍在各自的插件内完成。
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, analyzer):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self.analyzer = analyzer
+        super().__init__(socket_path, _Handler)
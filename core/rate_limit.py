@@ -0,0 +1,139 @@
+import asyncio
+import fnmatch
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from astrbot.api import logger
+
+# 默认每秒请求数：详情/列表页走 Cloudflare，图片与缩略图服务器可以快一些
+DEFAULT_HOST_RATE_LIMITS = "nhentai.net=3, i*.nhentai.net=30, t*.nhentai.net=50"
+
+# Retry-After 最多遵守多久（秒），避免异常响应让整个任务停摆
+MAX_RETRY_AFTER = 120
+
+
+def parse_rate_limits(text):
+    """
+    解析 "host=rate, host=rate" 形式的配置，host 支持通配符（如 i*.nhentai.net），rate 为每秒请求数
+
+    Returns:
+        [(pattern, rate)]，按配置顺序排列；无法解析的项会被忽略
+    """
+    rates = []
+    for item in str(text or "").split(","):
+        if "=" not in item:
+            continue
+        pattern, rate = item.split("=", 1)
+        try:
+            rates.append((pattern.strip().lower(), float(rate)))
+        except ValueError:
+            logger.warning(f"无法解析限速配置: {item.strip()}")
+    return rates
+
+
+def parse_retry_after(value):
+    """解析 Retry-After（秒数或 HTTP 日期），返回需要等待的秒数；无法解析时返回 None"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class TokenBucket:
+    """令牌桶（线程安全）。取令牌时预约：令牌不足则记为欠账并返回需要等待的时间，调用方自行等待"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self.requests = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    def reserve(self):
+        """预约一个令牌，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            if now > self._updated:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+            self._tokens -= 1
+            # 令牌从 _updated 起恢复；Retry-After 暂停期间 _updated 位于将来
+            wait = max(0.0, self._updated - now - self._tokens / self.rate)
+            self.requests += 1
+            if wait > 0:
+                self.waits += 1
+                self.wait_seconds += wait
+            return wait
+
+    def pause(self, seconds):
+        """服务器要求暂停（Retry-After）：暂停期间不再放行也不恢复令牌，暂停结束后只放行一个请求再按速率恢复"""
+        with self._lock:
+            if seconds <= 0:
+                return
+            now = time.monotonic()
+            if now > self._updated:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._tokens = min(self._tokens, 1.0)
+            self._updated = max(self._updated, now + seconds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rate": self.rate,
+                "requests": self.requests,
+                "waits": self.waits,
+                "wait_seconds": round(self.wait_seconds, 1),
+            }
+
+
+class HostRateLimiter:
+    """
+    按主机划分的令牌桶限速，爬虫与下载器共用一个实例；爬虫在事件循环中取得令牌后再发起请求（含交给线程的 cloudscraper 请求）
+
+    同一主机的请求无论来自哪个组件都从同一个桶中取令牌；匹配同一配置项的主机（如 i1/i2/i3）共用一个桶。
+    未匹配任何配置项或速率为 0 的主机不限速。
+    """
+
+    def __init__(self, rates=DEFAULT_HOST_RATE_LIMITS):
+        if isinstance(rates, str):
+            rates = parse_rate_limits(rates)
+        self._rules = [(pattern, rate) for pattern, rate in rates if rate > 0]
+        self._buckets = {pattern: TokenBucket(rate) for pattern, rate in self._rules}
+
+    def bucket_for(self, url):
+        host = (urlparse(url).hostname or "").lower()
+        for pattern, _ in self._rules:
+            if fnmatch.fnmatchcase(host, pattern):
+                return self._buckets[pattern]
+        return None
+
+    async def acquire(self, url):
+        """在事件循环中等待一个令牌"""
+        bucket = self.bucket_for(url)
+        if bucket is not None:
+            wait = bucket.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+    def retry_after(self, url, value):
+        """遵守响应中的 Retry-After，暂停该主机的请求；返回暂停的秒数，没有可用的 Retry-After 时返回 None"""
+        seconds = parse_retry_after(value)
+        bucket = self.bucket_for(url)
+        if seconds is None or bucket is None:
+            return None
+        seconds = min(seconds, MAX_RETRY_AFTER)
+        bucket.pause(seconds)
+        logger.info(f"{urlparse(url).hostname} 要求 {seconds:.0f} 秒后重试，已暂停该主机的请求")
+        return seconds
+
+    def stats(self):
+        return {pattern: bucket.stats() for pattern, bucket in self._buckets.items()}
@@ -318,6 +318,18 @@ class ResultRenderer:
         else:
             display_tags = ["页数未知"]
 
+        # 抽样估计时展示样本量与置信区间
+        stats = gallery.get("stats") or {}
+        if stats.get("estimated"):
+            display_tags.append(f"抽样 {stats.get('sampled', 0)} 页")
+            ci = stats.get("ci")
+            if ci:
+                display_tags.append(f"区间 {int(ci[0])}%-{int(ci[1])}%")
+        elif stats.get("thumbnail"):
+            display_tags.append("缩略图评分")
+            if stats.get("escalated"):
+                display_tags.append(f"原图复核 {stats['escalated']} 页")
+
         for tag in display_tags:
             try:
                 tw = draw.textlength(tag, font=font_tag)
@@ -362,7 +374,9 @@ class ResultRenderer:
         )
 
         # CB指数显示
-        if isinstance(score, (int, float)):
+        if isinstance(score, (int, float)) and (stats.get("estimated") or stats.get("thumbnail")):
+            score_text = f"CB指数：约 {int(score)}%"
+        elif isinstance(score, (int, float)):
             score_text = f"CB指数：{int(score)}%"
         else:
             score_text = "CB指数：N/A"
@@ -0,0 +1,117 @@
+import math
+import random
+
+
+class AdaptiveSampler:
+    """CB 指数的自适应抽样估计器。
+
+    按分层随机顺序抽取页面：把本子按页码切成若干连续分层，每一轮从每个分层各取一页，
+    保证任意前缀样本都均匀覆盖整本。每记录一批结果后用带有限总体修正的 Wilson 区间
+    估计 NSFW 页占比，区间足够窄、或上界已低于当前前 10 名门槛时即可停止。
+    """
+
+    def __init__(
+        self,
+        total_pages,
+        ci_half_width=0.05,
+        min_samples=16,
+        strata=8,
+        z=1.96,
+        seed=None,
+    ):
+        self.total_pages = total_pages
+        self.ci_half_width = ci_half_width
+        self.min_samples = min_samples
+        self.strata = max(1, min(strata, total_pages or 1))
+        self.z = z
+        self._random = random.Random(seed)
+        self.sampled = 0
+        self.hentai = 0
+
+    def order(self):
+        """返回分层随机的页面下标顺序（0 起始），覆盖全部页面"""
+        layers = []
+        for s in range(self.strata):
+            start = s * self.total_pages // self.strata
+            end = (s + 1) * self.total_pages // self.strata
+            layer = list(range(start, end))
+            self._random.shuffle(layer)
+            layers.append(layer)
+
+        # 每一轮分层的访问顺序也打乱，避免总是先抽前面的页
+        order = []
+        while any(layers):
+            round_layers = [layer for layer in layers if layer]
+            self._random.shuffle(round_layers)
+            for layer in round_layers:
+                order.append(layer.pop())
+        return order
+
+    def record(self, sampled, hentai):
+        """记录一批已分类页面的数量及其中 NSFW 页数"""
+        self.sampled += sampled
+        self.hentai += hentai
+
+    @property
+    def ratio(self):
+        if self.sampled == 0:
+            return 0.0
+        return self.hentai / self.sampled
+
+    def interval(self):
+        """返回 NSFW 页占比的置信区间 (low, high)，取值 0~1"""
+        n = self.sampled
+        if n == 0:
+            return 0.0, 1.0
+
+        p = self.ratio
+        z2 = self.z * self.z
+        denominator = 1 + z2 / n
+        center = (p + z2 / (2 * n)) / denominator
+        half = self.z * math.sqrt(p * (1 - p) / n + z2 / (4 * n * n)) / denominator
+
+        # 有限总体修正：抽到的页数接近总页数时区间收窄，全部抽完时为精确值
+        if self.total_pages > 1:
+            half *= math.sqrt(max(0, self.total_pages - n) / (self.total_pages - 1))
+        if n >= self.total_pages:
+            return p, p
+
+        return max(0.0, center - half), min(1.0, center + half)
+
+    def stop_reason(self, cutoff=None):
+        """判断是否可以停止抽样。
+
+        Args:
+            cutoff: 可选，当前前 10 名的最低 CB 指数（百分比）
+
+        Returns:
+            str: 停止原因，"exhausted" / "confident" / "below_cutoff"；继续抽样时返回 None
+        """
+        if self.sampled >= self.total_pages:
+            return "exhausted"
+        if self.sampled < self.min_samples:
+            return None
+
+        low, high = self.interval()
+        if (high - low) / 2 <= self.ci_half_width:
+            return "confident"
+        if cutoff is not None and high * 100 < cutoff:
+            return "below_cutoff"
+        return None
+
+    def result(self, stop_reason=None):
+        """返回与 analyze_folder 相同格式的 (score, stats)"""
+        if self.sampled == 0:
+            return 0, {}
+
+        low, high = self.interval()
+        stats = {
+            "total": self.total_pages,
+            "hentai": round(self.ratio * self.total_pages),
+            "sampled": self.sampled,
+            "sampled_hentai": self.hentai,
+            "ci": [low * 100, high * 100],
+            "estimated": self.sampled < self.total_pages,
+            "stop_reason": stop_reason,
+        }
+        return self.ratio * 100, stats
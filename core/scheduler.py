@@ -0,0 +1,124 @@
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, CancelledError, Future, wait
+
+
+class BatchScheduler:
+    """跨本子的微批调度器。
+
+    多个本子的分析线程把待推理页面提交到同一个队列，由唯一的推理线程凑成固定大小的批次
+    统一推理，再通过 Future 把结果送回各自的本子。本子较短、各自的批次凑不满时，
+    多个本子的页面可以拼进同一批；模型仍只有一份，推理仍是串行的。
+    """
+
+    # 等待结果期间检查停止信号的间隔（秒）
+    CANCEL_POLL = 0.2
+
+    def __init__(self, infer_fn, batch_size=8, max_wait=0.02):
+        """
+        Args:
+            infer_fn: 推理函数，接收 [(img_path, image)]，返回等长的逐页结果
+            batch_size: 每批最多页数
+            max_wait: 收到第一页后最多等待多久（秒）来凑满一批
+        """
+        self.infer_fn = infer_fn
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batches = 0
+        self.pages = 0
+        self.dropped = 0
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="nh-infer", daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, page):
+        """提交一页 (img_path, image)，返回该页结果的 Future"""
+        future = Future()
+        self._queue.put((page, future))
+        self._ensure_thread()
+        return future
+
+    def classify(self, pages, stop_event=None):
+        """
+        提交一组页面并等待全部结果，返回与输入顺序一致的逐页结果
+
+        Raises:
+            CancelledError: 等待期间 stop_event 被设置；尚在排队的页面会被丢弃，不再推理
+        """
+        futures = [self.submit(page) for page in pages]
+        pending = set(futures)
+        while pending:
+            _, pending = wait(pending, timeout=self.CANCEL_POLL, return_when=FIRST_EXCEPTION)
+            if pending and stop_event is not None and stop_event.is_set():
+                for future in pending:
+                    future.cancel()
+                raise CancelledError()
+        return [future.result() for future in futures]
+
+    def _next_batch(self):
+        """阻塞取到第一页后，在 max_wait 内尽量凑满一批；收到结束标记时返回 None"""
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # 处理完这一批再退出
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            # 已被取消的页面（所属本子超时或中断）不再推理
+            size = len(batch)
+            batch = [(page, future) for page, future in batch if future.set_running_or_notify_cancel()]
+            self.dropped += size - len(batch)
+            if not batch:
+                continue
+
+            try:
+                records = self.infer_fn([page for page, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.pages += len(batch)
+            for (_, future), record in zip(batch, records):
+                future.set_result(record)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "pages": self.pages,
+            "avg_batch": round(self.pages / self.batches, 2) if self.batches else 0,
+            "dropped": self.dropped,
+        }
+
+    def close(self):
+        self._queue.put(None)
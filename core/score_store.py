@@ -0,0 +1,127 @@
+import os
+import json
+import sqlite3
+import threading
+import time
+from astrbot.api import logger
+
+
+class ScoreStore:
+    """本子评分的持久化缓存（SQLite）。
+
+    键为 (gid, media_id, fingerprint)，fingerprint 由模型文件哈希与阈值等评分参数组成，
+    换模型或调阈值后旧结果自然失效。条目按 TTL 过期，超过数量上限时按最近访问时间淘汰。
+    """
+
+    def __init__(self, db_path, ttl_seconds=72 * 3600, max_entries=5000):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir and not os.path.exists(db_dir):
+                os.makedirs(db_dir)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS scores (
+                    gid TEXT NOT NULL,
+                    media_id TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    score REAL NOT NULL,
+                    stats TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (gid, media_id, fingerprint)
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_scores_accessed ON scores (accessed_at)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get(self, gid, media_id, fingerprint):
+        """查询评分缓存
+
+        Returns:
+            (score, stats)；未命中或已过期返回 None
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT score, stats, created_at FROM scores "
+                "WHERE gid = ? AND media_id = ? AND fingerprint = ?",
+                (str(gid), str(media_id), fingerprint),
+            ).fetchone()
+            if row is None:
+                return None
+
+            score, stats, created_at = row
+            if now - created_at > self.ttl_seconds:
+                conn.execute(
+                    "DELETE FROM scores WHERE gid = ? AND media_id = ? AND fingerprint = ?",
+                    (str(gid), str(media_id), fingerprint),
+                )
+                conn.commit()
+                return None
+
+            conn.execute(
+                "UPDATE scores SET accessed_at = ? "
+                "WHERE gid = ? AND media_id = ? AND fingerprint = ?",
+                (now, str(gid), str(media_id), fingerprint),
+            )
+            conn.commit()
+
+        return score, json.loads(stats)
+
+    def put(self, gid, media_id, fingerprint, score, stats):
+        """写入评分缓存，并顺带淘汰过期或超量的条目"""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO scores "
+                "(gid, media_id, fingerprint, score, stats, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    str(gid),
+                    str(media_id),
+                    fingerprint,
+                    float(score),
+                    json.dumps(stats, ensure_ascii=False),
+                    now,
+                    now,
+                ),
+            )
+            self._evict(conn, now)
+            conn.commit()
+
+    def _evict(self, conn, now):
+        conn.execute(
+            "DELETE FROM scores WHERE created_at < ?", (now - self.ttl_seconds,)
+        )
+        if self.max_entries <= 0:
+            return
+
+        (count,) = conn.execute("SELECT COUNT(*) FROM scores").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            conn.execute(
+                "DELETE FROM scores WHERE rowid IN "
+                "(SELECT rowid FROM scores ORDER BY accessed_at ASC LIMIT ?)",
+                (overflow,),
+            )
+            logger.debug(f"评分缓存超出上限，淘汰 {overflow} 条")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
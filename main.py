@@ -82,3 +82,6 @@ class DailyNHentaiPlugin(Star):
 
         else:
             yield event.plain_result("未知指令。请使用 /nh recent、/nh today 或 /nh <id>")
+
+    async def terminate(self):
+        await self.manager.close()
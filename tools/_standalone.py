@@ -0,0 +1,23 @@
+"""在 AstrBot 之外运行工具脚本时的环境准备。"""
+import os
+import sys
+import types
+import logging
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup():
+    """把插件目录加入 sys.path；未安装 AstrBot 时用标准 logging 代替 astrbot.api.logger"""
+    if PLUGIN_DIR not in sys.path:
+        sys.path.insert(0, PLUGIN_DIR)
+    try:
+        import astrbot.api  # noqa: F401
+    except ImportError:
+        logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+        api = types.ModuleType("astrbot.api")
+        api.logger = logging.getLogger("daily_nhentai")
+        package = types.ModuleType("astrbot")
+        package.api = api
+        sys.modules["astrbot"] = package
+        sys.modules["astrbot.api"] = api
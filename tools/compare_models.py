@@ -0,0 +1,127 @@
+"""在本地样本上对比两种推理后端 / 精度的逐本 CB 指数、前 N 名顺序与耗时。
+
+用法（在插件目录下执行）:
+    python tools/compare_models.py 样本目录 --candidate onnx
+    python tools/compare_models.py 样本目录 --baseline onnx --candidate onnx:int8
+
+样本目录下每个子目录放一个本子的图片，子目录名即本子 ID。
+"""
+import os
+import sys
+import time
+import argparse
+
+from _standalone import PLUGIN_DIR, setup
+
+setup()
+
+from core.analyzer import NSFWAnalyzer  # noqa: E402
+
+
+def list_galleries(sample_dir):
+    galleries = sorted(
+        d for d in os.listdir(sample_dir) if os.path.isdir(os.path.join(sample_dir, d))
+    )
+    return [(name, os.path.join(sample_dir, name)) for name in galleries]
+
+
+def parse_model_spec(spec):
+    """解析 backend[:precision]，例如 onnx:int8"""
+    backend, _, precision = spec.partition(":")
+    return backend, precision or "fp32"
+
+
+def ranking(scores, top):
+    return [gid for gid, _ in sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:top]]
+
+
+def score_galleries(galleries, args, spec):
+    """用指定后端与精度给所有样本本子评分，返回 ({gid: score}, 总推理耗时)"""
+    backend, precision = parse_model_spec(spec)
+    analyzer = NSFWAnalyzer(
+        os.path.join(PLUGIN_DIR, "models"),
+        threshold=args.threshold,
+        device=args.device,
+        batch_size=args.batch_size,
+        # 关闭去重，保证两边推理的页面完全相同
+        dedup=False,
+        model_backend=backend,
+        model_precision=precision,
+    )
+    if not analyzer.ensure_model():
+        sys.exit(f"{spec} 模型加载失败")
+    if (analyzer.backend, analyzer.precision) != (backend, precision):
+        sys.exit(f"未找到 {spec} 模型，请先运行 tools/export_model.py / tools/quantize_model.py")
+
+    scores = {}
+    elapsed = 0.0
+    for gid, path in galleries:
+        started = time.perf_counter()
+        score, stats = analyzer.analyze_folder(path)
+        elapsed += time.perf_counter() - started
+        if "error" in stats:
+            sys.exit(f"{gid} 评分失败: {stats['error']}")
+        scores[gid] = score
+    return scores, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比两种推理后端 / 精度的 CB 指数")
+    parser.add_argument("sample_dir", help="样本目录，每个子目录为一个本子")
+    parser.add_argument("--baseline", default="pytorch", help="基准，格式 backend[:precision]，默认 pytorch")
+    parser.add_argument(
+        "--candidate", required=True, help="待对比，格式 backend[:precision]，例如 onnx、onnx:int8"
+    )
+    parser.add_argument("--threshold", type=float, default=0.08)
+    parser.add_argument("--device", default="")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument(
+        "--tolerance", type=float, default=1.0, help="允许的单本 CB 指数最大偏差（百分点），默认 1.0"
+    )
+    parser.add_argument("--top", type=int, default=10, help="检查前 N 名的顺序是否变化，默认 10")
+    args = parser.parse_args()
+
+    galleries = list_galleries(args.sample_dir)
+    if not galleries:
+        print(f"{args.sample_dir} 下没有样本子目录")
+        return
+
+    base_scores, base_time = score_galleries(galleries, args, args.baseline)
+    cand_scores, cand_time = score_galleries(galleries, args, args.candidate)
+
+    print("gid".ljust(12) + args.baseline.rjust(10) + args.candidate.rjust(10) + "drift".rjust(8))
+    drifts = []
+    for gid, _ in galleries:
+        drift = cand_scores[gid] - base_scores[gid]
+        drifts.append(abs(drift))
+        print(
+            gid.ljust(12)
+            + f"{base_scores[gid]:>10.1f}{cand_scores[gid]:>10.1f}{drift:>+8.1f}"
+        )
+
+    print(
+        f"共 {len(galleries)} 个本子，最大偏差 {max(drifts):.2f}，平均偏差 {sum(drifts) / len(drifts):.2f} 个百分点"
+    )
+    print(
+        f"推理耗时 {args.baseline} {base_time:.1f}s / {args.candidate} {cand_time:.1f}s"
+        f"（{base_time / max(cand_time, 1e-9):.2f}x）"
+    )
+
+    base_top = ranking(base_scores, args.top)
+    cand_top = ranking(cand_scores, args.top)
+    reordered = base_top != cand_top
+    if reordered:
+        print(f"前 {args.top} 名发生变化（重合 {len(set(base_top) & set(cand_top))} 个）:")
+        print(f"  {args.baseline}: {' '.join(base_top)}")
+        print(f"  {args.candidate}: {' '.join(cand_top)}")
+    else:
+        print(f"前 {args.top} 名顺序一致")
+
+    if max(drifts) > args.tolerance:
+        print(f"偏差超过容差 {args.tolerance}")
+    if max(drifts) > args.tolerance or reordered:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""把 models 目录中的 .pt / Transformers 模型导出为 ONNX 或 OpenVINO 格式。
+
+用法（在插件目录下执行）:
+    python tools/export_model.py --format onnx
+    python tools/export_model.py --format openvino --model models/erax_nsfw_yolo11m.pt
+
+导出结果放在 models 目录中，配置项 model_backend 设为对应格式即可使用。
+"""
+import os
+import glob
+import argparse
+
+from _standalone import PLUGIN_DIR
+
+
+def find_source(models_dir):
+    """查找原始模型：优先 .pt，其次带 config.json 的 Transformers 目录"""
+    pt_files = sorted(glob.glob(os.path.join(models_dir, "*.pt")))
+    if pt_files:
+        return pt_files[0]
+    for path in sorted(glob.glob(os.path.join(models_dir, "*"))) + [models_dir]:
+        if not os.path.exists(os.path.join(path, "config.json")):
+            continue
+        # 跳过已导出的目录
+        if glob.glob(os.path.join(path, "*.onnx")) or os.path.exists(os.path.join(path, "openvino_model.xml")):
+            continue
+        return path
+    return None
+
+
+def export_yolo(model_path, fmt, imgsz):
+    from ultralytics import YOLO
+
+    # dynamic=True 保留动态批大小，分析器才能按批推理
+    return YOLO(model_path).export(format=fmt, imgsz=imgsz, dynamic=True, half=False)
+
+
+def export_transformers(model_path, fmt):
+    from transformers import AutoImageProcessor
+
+    if fmt == "onnx":
+        from optimum.onnxruntime import ORTModelForImageClassification as model_cls
+    else:
+        from optimum.intel import OVModelForImageClassification as model_cls
+
+    output_dir = f"{os.path.normpath(model_path)}-{fmt}"
+    model = model_cls.from_pretrained(model_path, export=True)
+    model.save_pretrained(output_dir)
+    AutoImageProcessor.from_pretrained(model_path).save_pretrained(output_dir)
+    return output_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出 ONNX / OpenVINO 推理模型")
+    parser.add_argument("--format", choices=["onnx", "openvino"], default="onnx")
+    parser.add_argument("--model", help="要导出的 .pt 文件或 Transformers 目录，默认自动查找 models 目录")
+    parser.add_argument("--imgsz", type=int, default=640, help="YOLO 输入尺寸，默认 640")
+    args = parser.parse_args()
+
+    model_path = args.model or find_source(os.path.join(PLUGIN_DIR, "models"))
+    if not model_path:
+        print("models 目录下没有找到可导出的模型")
+        return
+
+    print(f"正在导出 {model_path} -> {args.format} ...")
+    if os.path.isfile(model_path):
+        output = export_yolo(model_path, args.format, args.imgsz)
+    else:
+        output = export_transformers(model_path, args.format)
+    print(f"导出完成: {output}")
+    print(f"将配置项 model_backend 设为 {args.format} 即可使用，可用 tools/compare_models.py 对比评分差异")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""本机共享的模型服务：一个进程持有模型，多个 AstrBot 实例通过 Unix socket 调用。
+
+用法（在插件目录下执行）:
+    python tools/model_server.py --socket /tmp/nh_model.sock
+
+各实例的配置项 model_server_socket 设为同一路径即可；服务不可用时插件自动改为进程内推理。
+"""
+import os
+import argparse
+
+from _standalone import PLUGIN_DIR, setup
+
+setup()
+
+from core.analyzer import NSFWAnalyzer  # noqa: E402
+from core.model_server import ModelServer  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动本机共享的 NSFW 模型服务")
+    parser.add_argument("--socket", default="/tmp/nh_model.sock", help="Unix socket 路径")
+    parser.add_argument("--device", default="", help="推理设备：cuda / cpu，留空自动选择")
+    parser.add_argument("--backend", default="", help="推理后端：pytorch / onnx / openvino")
+    parser.add_argument("--precision", default="fp32", help="模型精度：fp32 / int8")
+    parser.add_argument("--batch-size", type=int, default=8, help="单次推理批大小")
+    parser.add_argument(
+        "--batch-wait-ms", type=int, default=20, help="凑批等待时间（毫秒），多个实例的页面合并推理，0 关闭"
+    )
+    args = parser.parse_args()
+
+    analyzer = NSFWAnalyzer(
+        os.path.join(PLUGIN_DIR, "models"),
+        device=args.device,
+        batch_size=args.batch_size,
+        model_backend=args.backend,
+        model_precision=args.precision,
+        batch_wait_ms=args.batch_wait_ms,
+    )
+    # 启动前完成加载与预热，客户端连上即可推理
+    analyzer.start_warmup()
+    analyzer.wait_warmup()
+    if analyzer.classifier is None:
+        raise SystemExit("模型加载失败")
+
+    with ModelServer(args.socket, analyzer) as server:
+        print(f"模型服务已启动: {args.socket} ({analyzer.model_type}/{analyzer.backend})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if os.path.exists(args.socket):
+                os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
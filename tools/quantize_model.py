@@ -0,0 +1,166 @@
+"""把导出的 ONNX 模型量化为 INT8。
+
+用法（在插件目录下执行）:
+    python tools/quantize_model.py --mode static --calibration 校准图片目录
+    python tools/quantize_model.py --mode dynamic
+
+YOLO 模型 models/xxx.onnx 量化为 models/xxx.int8.onnx；
+Transformers 模型目录 models/xxx-onnx/ 量化为 models/xxx-onnx-int8/。
+配置项 model_backend 设为 onnx、model_precision 设为 int8 即可使用。
+"""
+import os
+import glob
+import shutil
+import random
+import argparse
+
+import numpy as np
+from PIL import Image
+
+from _standalone import PLUGIN_DIR
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif')
+
+
+def find_source(models_dir):
+    """查找 FP32 ONNX 模型：YOLO 的 .onnx 文件，或带 .onnx 的 Transformers 目录"""
+    for path in sorted(glob.glob(os.path.join(models_dir, "*.onnx"))):
+        if "int8" not in os.path.basename(path).lower():
+            return path
+    for path in sorted(glob.glob(os.path.join(models_dir, "*"))):
+        if (
+            os.path.isdir(path)
+            and "int8" not in os.path.basename(path).lower()
+            and os.path.exists(os.path.join(path, "config.json"))
+            and glob.glob(os.path.join(path, "*.onnx"))
+        ):
+            return path
+    return None
+
+
+def list_images(calibration_dir, limit, seed=0):
+    images = sorted(
+        f for f in glob.glob(os.path.join(calibration_dir, "**", "*"), recursive=True)
+        if f.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    random.Random(seed).shuffle(images)
+    return images[:limit]
+
+
+def yolo_preprocess(imgsz):
+    """与 ultralytics 推理一致的预处理：letterbox 到 imgsz，BGR→RGB，归一化到 0~1，NCHW"""
+    from ultralytics.data.augment import LetterBox
+
+    letterbox = LetterBox(new_shape=(imgsz, imgsz), auto=False)
+
+    def preprocess(path):
+        bgr = np.asarray(Image.open(path).convert("RGB"))[:, :, ::-1]
+        img = letterbox(image=np.ascontiguousarray(bgr))
+        img = img[:, :, ::-1].transpose(2, 0, 1)
+        return np.ascontiguousarray(img, dtype=np.float32)[None] / 255.0
+
+    return preprocess
+
+
+def transformers_preprocess(model_dir):
+    from transformers import AutoImageProcessor
+
+    processor = AutoImageProcessor.from_pretrained(model_dir)
+
+    def preprocess(path):
+        image = Image.open(path).convert("RGB")
+        return processor(images=image, return_tensors="np")["pixel_values"].astype(np.float32)
+
+    return preprocess
+
+
+class ImageCalibrationReader:
+    """onnxruntime 静态量化的校准数据：逐张返回预处理后的输入"""
+
+    def __init__(self, input_name, paths, preprocess):
+        self.input_name = input_name
+        self.paths = iter(paths)
+        self.preprocess = preprocess
+
+    def get_next(self):
+        for path in self.paths:
+            try:
+                return {self.input_name: self.preprocess(path)}
+            except Exception as e:
+                print(f"跳过校准图片 {path}: {e}")
+        return None
+
+
+def quantize(src_onnx, dst_onnx, mode, reader=None):
+    from onnxruntime.quantization import (
+        QuantFormat,
+        QuantType,
+        quantize_dynamic,
+        quantize_static,
+    )
+
+    if mode == "dynamic":
+        quantize_dynamic(src_onnx, dst_onnx, weight_type=QuantType.QInt8)
+    else:
+        quantize_static(
+            src_onnx,
+            dst_onnx,
+            reader,
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把 ONNX 模型量化为 INT8")
+    parser.add_argument("--mode", choices=["dynamic", "static"], default="static")
+    parser.add_argument("--model", help="FP32 .onnx 文件或导出的 Transformers 目录，默认自动查找 models 目录")
+    parser.add_argument("--calibration", help="静态量化的校准图片目录（本地样本页面）")
+    parser.add_argument("--max-images", type=int, default=200, help="最多使用的校准图片数，默认 200")
+    parser.add_argument("--imgsz", type=int, default=640, help="YOLO 输入尺寸，需与导出时一致，默认 640")
+    args = parser.parse_args()
+
+    model_path = args.model or find_source(os.path.join(PLUGIN_DIR, "models"))
+    if not model_path:
+        print("models 目录下没有找到 FP32 ONNX 模型，请先运行 tools/export_model.py --format onnx")
+        return
+
+    is_yolo = os.path.isfile(model_path)
+    if is_yolo:
+        src_onnx = model_path
+        dst_onnx = model_path[: -len(".onnx")] + ".int8.onnx"
+    else:
+        output_dir = f"{os.path.normpath(model_path)}-int8"
+        # 配置文件与预处理参数原样复制，只替换 .onnx
+        shutil.copytree(
+            model_path, output_dir, dirs_exist_ok=True, ignore=shutil.ignore_patterns("*.onnx")
+        )
+        src_onnx = sorted(glob.glob(os.path.join(model_path, "*.onnx")))[0]
+        dst_onnx = os.path.join(output_dir, "model.int8.onnx")
+
+    reader = None
+    if args.mode == "static":
+        if not args.calibration:
+            parser.error("静态量化需要 --calibration 校准图片目录")
+        import onnxruntime
+
+        images = list_images(args.calibration, args.max_images)
+        if not images:
+            print(f"{args.calibration} 下没有图片")
+            return
+        input_name = onnxruntime.InferenceSession(
+            src_onnx, providers=["CPUExecutionProvider"]
+        ).get_inputs()[0].name
+        preprocess = yolo_preprocess(args.imgsz) if is_yolo else transformers_preprocess(model_path)
+        reader = ImageCalibrationReader(input_name, images, preprocess)
+        print(f"使用 {len(images)} 张校准图片")
+
+    print(f"正在{'静态' if args.mode == 'static' else '动态'}量化 {src_onnx} -> {dst_onnx} ...")
+    quantize(src_onnx, dst_onnx, args.mode, reader)
+    print("量化完成，可用 tools/compare_models.py 对比 FP32 与 INT8 的 CB 指数")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""用已保存的逐页原始检测结果按不同阈值重算 CB 指数，无需重新推理。
+
+不同模型的结果分开保存，默认只重算最近使用的模型，可用 --model 指定模型指纹（前缀即可）。
+
+用法（在插件目录下执行）:
+    python tools/rescore.py --threshold 0.05 0.08 0.12
+    python tools/rescore.py --threshold 0.05 0.08 --model yolo:3f2a
+"""
+import os
+import time
+import argparse
+
+from _standalone import PLUGIN_DIR, setup
+
+setup()
+
+from core.detections import DetectionStore  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按不同阈值离线重算 CB 指数")
+    parser.add_argument(
+        "--threshold", type=float, nargs="+", required=True, help="要对比的阈值，可传多个"
+    )
+    parser.add_argument(
+        "--data-dir",
+        default=os.path.join(PLUGIN_DIR, "data", "detections"),
+        help="原始检测结果目录，默认 data/detections",
+    )
+    parser.add_argument(
+        "--top", type=int, default=10, help="统计各阈值下前 N 名与第一个阈值的重合数"
+    )
+    parser.add_argument(
+        "--model", default="", help="只重算该模型指纹（可写前缀）的结果，默认为最近使用的模型"
+    )
+    args = parser.parse_args()
+
+    store = DetectionStore(args.data_dir, ttl_seconds=float("inf"))
+    models = store.models()
+    if not models:
+        print(f"{args.data_dir} 下没有原始检测结果")
+        return
+    matched = [model for model in models if model.startswith(args.model)]
+    if not matched:
+        print(f"没有模型指纹以 {args.model} 开头，已保存的模型: {', '.join(models)}")
+        return
+    model = matched[0]
+    if len(models) > 1:
+        others = ", ".join(f"{m} ({n} 个)" for m, n in models.items() if m != model)
+        print(f"重算模型 {model}；其他模型: {others}")
+    files = store.iter_files(model)
+
+    started = time.perf_counter()
+    rows = []
+    for path in files:
+        meta = store.load(path)[0]
+        scores = []
+        total = 0
+        for threshold in args.threshold:
+            score, stats = store.rescore_file(path, threshold)
+            scores.append(score)
+            total = stats.get("total", 0)
+        rows.append((meta["gid"], meta["media_id"], total, scores))
+    elapsed = time.perf_counter() - started
+
+    header = "gid".ljust(10) + "pages".rjust(7)
+    header += "".join(f"{t:>10.2f}" for t in args.threshold)
+    print(header)
+    for gid, _, total, scores in sorted(rows, key=lambda r: r[3][0], reverse=True):
+        print(gid.ljust(10) + str(total).rjust(7) + "".join(f"{s:>10.1f}" for s in scores))
+
+    base_top = {
+        r[0] for r in sorted(rows, key=lambda r: r[3][0], reverse=True)[: args.top]
+    }
+    for i, threshold in enumerate(args.threshold[1:], 1):
+        top = {
+            r[0] for r in sorted(rows, key=lambda r: r[3][i], reverse=True)[: args.top]
+        }
+        print(
+            f"阈值 {threshold:.2f} 前 {args.top} 名与阈值 {args.threshold[0]:.2f} 重合 {len(top & base_top)} 个"
+        )
+    print(f"共 {len(rows)} 个本子，重算耗时 {elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()